@@ -3,6 +3,7 @@ from dotenv import load_dotenv # Imports load_dotenv() from the python-dotenv pa
 from app import create_app, db # create_app is application factory function is the function which we will write in __init__.py file and db is SQLAlchemy database instance
                                # Also the database object is being created in the init itself
 from app.logger import configure_logger
+from app.migrations import upgrade_database
 
 load_dotenv() # Reads the .env file and Loads all key-value pairs into os.environ
 
@@ -23,6 +24,7 @@ app = create_app() # Create the app with create_app() functionality
 # app.app_context() sets app as the active Flask application so its configuration and extensions can be used safely.
 with app.app_context():
     db.create_all() # Create database tables, Based on models defined using db.Model, Runs only if tables do not already exist
+    upgrade_database() # Add new indexes to tables that already existed before (create_all does not touch them), data migrations are flask CLI commands
 
 # Main module check -
 # What is __name__ - Python gives every file a special variable called __name__
@@ -28,10 +28,69 @@ def create_app():
     app.config['CACHE_REDIS_URL'] = os.getenv('CACHE_REDIS_URL')
     app.config['CACHE_REDIS_PORT'] = os.getenv("CACHE_REDIS_PORT")
     app.config['CACHE_DEFAULT_TIMEOUT'] = os.getenv('CACHE_DEFAULT_TIMEOUT')
+    # Streaming pipeline - how many posts are scored and saved together in one micro-batch
+    # Same default as SENTIMENT_POOL_MIN_BATCH in app.analysis, so full batches are scored by the process pool
+    app.config['PIPELINE_BATCH_SIZE'] = int(os.getenv('PIPELINE_BATCH_SIZE', 200))
+    # Rows per bulk INSERT statement in app.persistence
+    app.config['BULK_INSERT_CHUNK_SIZE'] = int(os.getenv('BULK_INSERT_CHUNK_SIZE', 1000))
+    # Asynchronous analyze jobs - background threads, how many jobs may wait, how long finished results are kept (seconds)
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+    app.config['JOB_MAX_PENDING'] = int(os.getenv('JOB_MAX_PENDING', 32))
+    app.config['JOB_RESULT_TTL'] = int(os.getenv('JOB_RESULT_TTL', 3600))
+    # /analyze result cache (app.result_cache) - seconds fresh, extra seconds served stale while refreshing,
+    # max seconds a build lock is held, seconds a request waits for another worker's build
+    app.config['RESULT_CACHE_TTL'] = int(os.getenv('RESULT_CACHE_TTL', 3600))
+    app.config['RESULT_CACHE_STALE_TTL'] = int(os.getenv('RESULT_CACHE_STALE_TTL', 3600))
+    app.config['RESULT_CACHE_LOCK_TIMEOUT'] = int(os.getenv('RESULT_CACHE_LOCK_TIMEOUT', 120))
+    app.config['RESULT_CACHE_WAIT'] = int(os.getenv('RESULT_CACHE_WAIT', 30))
+    # Slow request profiling for /metrics (app.metrics) - seconds before a profile is kept (0 = off),
+    # share of requests that run under cProfile, folder for the .prof files
+    app.config['METRICS_PROFILE_THRESHOLD'] = float(os.getenv('METRICS_PROFILE_THRESHOLD', 0))
+    app.config['METRICS_PROFILE_SAMPLE_RATE'] = float(os.getenv('METRICS_PROFILE_SAMPLE_RATE', 0.1))
+    app.config['METRICS_PROFILE_DIR'] = os.getenv('METRICS_PROFILE_DIR', 'profiles')
+    # Retention and compaction of the stored results (app.retention) - days rows are kept (0 = forever),
+    # rows / posts deleted per transaction, seconds between two compactions, seconds of rest between batches
+    app.config['RETENTION_DAYS'] = int(os.getenv('RETENTION_DAYS', 0))
+    app.config['COMPACTION_BATCH_SIZE'] = int(os.getenv('COMPACTION_BATCH_SIZE', 1000))
+    app.config['COMPACTION_INTERVAL'] = int(os.getenv('COMPACTION_INTERVAL', 3600))
+    app.config['COMPACTION_PAUSE'] = float(os.getenv('COMPACTION_PAUSE', 0.1))
+    # Background warmer for the most requested /analyze topics (app.warmer) - topics per round (0 = off),
+    # seconds between rounds, topics refreshed at once, max random delay per refresh, requests before a topic counts as hot
+    app.config['WARMER_TOP_N'] = int(os.getenv('WARMER_TOP_N', 0))
+    app.config['WARMER_INTERVAL'] = int(os.getenv('WARMER_INTERVAL', 900))
+    app.config['WARMER_CONCURRENCY'] = int(os.getenv('WARMER_CONCURRENCY', 2))
+    app.config['WARMER_JITTER'] = float(os.getenv('WARMER_JITTER', 30))
+    app.config['WARMER_MIN_REQUESTS'] = float(os.getenv('WARMER_MIN_REQUESTS', 2))
+    # Load the analyzer, chart libraries and database connection before the first request (off by default)
+    app.config['PREWARM'] = os.getenv('PREWARM', '0') == '1'
     db.init_app(app) # This line connects db to the Flask app, after this db knows which app to use, 
                   # Hey db, this is the Flask app you should work with.
     cache.init_app(app) # For the cache also you will initialize this app
 
+    # Background job runner for the asynchronous mode of /analyze
+    from app.jobs import jobs
+    jobs.init_app(app)
+
+    # JSON logs written by a background thread, with a request id on every line (app.logger)
+    from app.logger import init_request_logging
+    init_request_logging(app)
+
+    # Latency histograms and counters, served as Prometheus text on /metrics
+    from app.metrics import metrics
+    metrics.init_app(app)
+
+    # Background thread that deletes results older than RETENTION_DAYS (only started when it is set)
+    from app.retention import compactor
+    compactor.init_app(app)
+
+    # Keeps the cache entries of the most requested topics warm (only started when WARMER_TOP_N is set)
+    from app.warmer import warmer
+    warmer.init_app(app)
+
+    # flask CLI maintenance commands (flask rebuild-rollups, flask compact ...)
+    from app.commands import register_commands
+    register_commands(app)
+
     # From here we will start working with routes.py file
     # we have to modularise the code and we have to create a blueprint
     # A Blueprint is a way to organize your Flask application by splitting it into smaller, feature-based parts 
@@ -51,5 +110,10 @@ def create_app():
     # ex - we have @sentiment_bp.route('/analyze') - Without prefix: http://localhost:5000/analyze
        # - with url_prefiz it will be http://localhost:5000/api/sentiment/analyze ie /api/sentiment  +  /analyze
     app.register_blueprint(sentiments_bp, url_prefix = '/api/sentiment')
+
+    # Heavy libraries and the sentiment analyzer are loaded on first use, PREWARM=1 loads them now instead (see app.prewarm)
+    if app.config['PREWARM']:
+        from app.prewarm import prewarm
+        prewarm(app)
     return app
 
@@ -1,21 +1,88 @@
-import nltk
 import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 # Now we will have the main part - w will not downloading the vader_lexical package
 # we can directly use it form the current working directory - and specify as a path to be used
-
-# This line tells NLTK where to look for its downloaded data files (like vader_lexicon)
 # os.getcwd() - /Users/prathamsharma/scoreAnalyzer
 # 'nltk_data' - Folder name where NLTK resources are stored
 # os.path.join(os.getcwd(), 'nltk_data') - Safely combines paths
+NLTK_DATA_PATH = os.path.join(os.getcwd(), 'nltk_data')
+
+# NLTK and the analyzer are loaded lazily - importing nltk and reading the VADER lexicon takes a noticeable part
+# of a second, and workers / test runs that never score a post should not pay for it at startup.
+# get_analyzer() builds the SentimentIntensityAnalyzer on first use, app.prewarm can do it ahead of the first request.
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+# Import nltk and tell it where to look for its downloaded data files (like vader_lexicon)
 # nltk.data.path.append(...) - Adds a new directory to NLTK’s search list, tells the NLTK Also check this folder when looking for directory
-nltk.data.path.append(os.path.join(os.getcwd(), 'nltk_data'))
+def load_nltk():
+    import nltk
+    if NLTK_DATA_PATH not in nltk.data.path:
+        nltk.data.path.append(NLTK_DATA_PATH)
+    return nltk
+
+
+# The shared SentimentIntensityAnalyzer of this process, created once on first use
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                load_nltk()
+                # Import the model SentimentIntensityAnalyzer from the vader
+                from nltk.sentiment.vader import SentimentIntensityAnalyzer
+                _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
+
+
+# `from app.analysis import sia` still works, it now builds the analyzer on first access
+def __getattr__(name):
+    if name == 'sia':
+        return get_analyzer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Import the model SentimentIntensityAnalyzer from the vader
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
+# Batch scoring settings, read from the environment so they can be tuned per deployment
+# SENTIMENT_WORKERS - how many worker processes the pool uses (default: one per CPU core)
+# SENTIMENT_POOL_MIN_BATCH - batches smaller than this are scored in-process, starting processes is not worth it for a few posts
+# SENTIMENT_CHUNKSIZE - how many posts are sent to a worker in one go (default: worked out from the batch size)
+# SENTIMENT_ENGINE - 'vader' (default, NLTK reference) or 'fast' (vectorized numpy engine in app.fast_analysis, for bulk backfills)
+# SENTIMENT_MP_START_METHOD - how worker processes are started, 'forkserver' (default where available) or 'spawn'
+#   Plain 'fork' is not used: the web server runs request and job threads, and forking a process that has
+#   other threads running can copy a lock that is held and deadlock the child
+# The streaming pipeline (app.pipeline) sends PIPELINE_BATCH_SIZE posts per batch, its default is the same 200
+# so a full micro-batch reaches the pool. Smaller batches give earlier first results but stay in this process.
+DEFAULT_MIN_POOL_BATCH = 200
 
-# Then create the object for the SentimentIntensityAnalyzer
-sia = SentimentIntensityAnalyzer()
+_pool = None
+_pool_size = None
+_pool_lock = threading.Lock()
+
+# Each worker process keeps its own analyzer here, it is created once by _init_worker() when the worker starts
+_worker_sia = None
+
+
+# Build the result dictionary for one post with the given analyzer
+# Both the single process path and the worker processes use this so the output is always exactly the same
+def _score_post(analyzer, post):
+    # get the sentiments scores
+    # here the polarity_scores() will take the content and then we can go for compound scoring
+    sentiment_score = analyzer.polarity_scores(post['content'])['compound']
+
+    # Classiy sentiment based on the compound score
+    sentiment = 'POSITIVE' if sentiment_score >=0 else 'NEGATIVE'
+
+    # below dictonary will be created and then added to the results array
+    return {
+        "title": post['title'],
+        "content": post['content'],
+        "sentiment": sentiment,
+        "score": sentiment_score
+    }
 
 # Here we have defined the analyse_sentiment() function and in this we are depicting the all the posts with posts variable
 # Creating the posts variable pointing to the posts using for analysing the sentiment
@@ -23,18 +90,96 @@ sia = SentimentIntensityAnalyzer()
 def analyse_sentiment(posts):
     results = [] # the result of each and every post will be saved in the results in array format
     for post in posts:
-        # get the sentiments scores
-        # here the polarity_scores() will take the content and then we can go for compound scoring
-        sentiment_score = sia.polarity_scores(post['content'])['compound']
-
-        # Classiy sentiment based on the compound score
-        sentiment = 'POSITIVE' if sentiment_score >=0 else 'NEGATIVE'
-
-        #append the results - below dictonary will be created and then added to the results array
-        results.append({
-            "title": post['title'],
-            "content": post['content'],
-            "sentiment": sentiment,
-            "score": sentiment_score
-        })
-    return results
\ No newline at end of file
+        #append the results
+        results.append(_score_post(get_analyzer(), post))
+    return results
+
+
+# Runs once inside every worker process when the pool starts it
+# The VADER lexicon is loaded here a single time instead of once per post
+def _init_worker(nltk_paths):
+    global _worker_sia
+    nltk = load_nltk()
+    for path in nltk_paths:
+        if path not in nltk.data.path:
+            nltk.data.path.append(path)
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    _worker_sia = SentimentIntensityAnalyzer()
+
+# Score a chunk of posts inside a worker process
+def _score_chunk(posts):
+    return [_score_post(_worker_sia, post) for post in posts]
+
+
+# Start method for the worker processes (see SENTIMENT_MP_START_METHOD above)
+def _mp_context():
+    method = os.getenv('SENTIMENT_MP_START_METHOD')
+    if not method:
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    context = multiprocessing.get_context(method)
+    if method == 'forkserver':
+        # The fork server only needs this module, not the web app's __main__ (app.py creates the app and tables)
+        context.set_forkserver_preload(['app.analysis'])
+    return context
+
+
+# Get the shared process pool, it is created on first use and reused by every later batch
+# If the requested size changes the old pool is shut down and a new one is started
+def get_pool(workers=None):
+    global _pool, _pool_size
+    workers = workers or int(os.getenv('SENTIMENT_WORKERS') or os.cpu_count() or 1)
+    with _pool_lock:
+        if _pool is None or _pool_size != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=True)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=_mp_context(),
+                initializer=_init_worker,
+                initargs=(list(load_nltk().data.path),)
+            )
+            _pool_size = workers
+        return _pool
+
+# Stop the worker processes, also registered with atexit so they do not outlive the app
+def shutdown_pool():
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool = None
+        _pool_size = None
+
+atexit.register(shutdown_pool)
+
+
+# Batch version of analyse_sentiment()
+# posts can be a list or any iterable (for example a generator of Reddit posts)
+# Big batches are split into chunks and spread across the worker processes, small batches stay in this process
+# The results come back in the same order as the posts and are the same dictionaries analyse_sentiment() returns
+def analyse_sentiment_batch(posts, workers=None, chunksize=None, min_batch=None, engine=None):
+    posts = list(posts)
+
+    # The fast engine scores the whole batch with array operations, it does not need the process pool
+    engine = engine or os.getenv('SENTIMENT_ENGINE', 'vader')
+    if engine == 'fast':
+        from app.fast_analysis import analyse_sentiment_fast
+        return analyse_sentiment_fast(posts)
+
+    workers = workers or int(os.getenv('SENTIMENT_WORKERS') or os.cpu_count() or 1)
+    if min_batch is None:
+        min_batch = int(os.getenv('SENTIMENT_POOL_MIN_BATCH', DEFAULT_MIN_POOL_BATCH))
+
+    # Not worth sending a handful of posts to other processes
+    if workers <= 1 or len(posts) < min_batch:
+        return analyse_sentiment(posts)
+
+    # Around four chunks per worker keeps every core busy without too much pickling overhead
+    chunksize = chunksize or int(os.getenv('SENTIMENT_CHUNKSIZE') or 0) or max(1, len(posts) // (workers * 4))
+    chunks = [posts[i:i + chunksize] for i in range(0, len(posts), chunksize)]
+
+    # pool.map() keeps the order of the chunks, so the flattened list lines up with the input posts
+    results = []
+    for chunk_results in get_pool(workers).map(_score_chunk, chunks):
+        results.extend(chunk_results)
+    return results
@@ -0,0 +1,101 @@
+import click
+from flask.cli import with_appcontext
+
+# Maintenance commands, run with the flask CLI, e.g.
+#   flask --app app:create_app rebuild-rollups
+#   flask --app app:create_app rebuild-rollups --topic python
+#   flask --app app:create_app rebuild-token-counts
+#   flask --app app:create_app compact --days 30
+#   flask --app app:create_app migrate-posts
+#   flask --app app:create_app export --topic python --since 2026-01-01 --format ndjson --output python.ndjson.gz
+
+
+# Recompute the hourly/daily rollups from the raw rows
+# Needed once for rows saved before rollups existed, or after rows were changed by hand
+@click.command('rebuild-rollups')
+@click.option('--topic', default=None, help='Only rebuild this topic (default: every topic)')
+@with_appcontext
+def rebuild_rollups_command(topic):
+    from app.rollups import rebuild_rollups
+
+    buckets = rebuild_rollups(topic)
+    click.echo(f'Rebuilt {buckets} rollup buckets')
+
+
+# Count the word cloud words (topic_token_count) again from the stored rows
+# Needed once for rows saved before the counts existed, otherwise their words are missing from the word cloud
+@click.command('rebuild-token-counts')
+@click.option('--topic', default=None, help='Only rebuild this topic (default: every topic)')
+@with_appcontext
+def rebuild_token_counts_command(topic):
+    from app.token_counts import rebuild_token_counts
+
+    topics = rebuild_token_counts(topic)
+    click.echo(f'Rebuilt the word counts of {topics} topics')
+
+
+# Delete results older than the retention period and the posts nothing refers to any more (see app.retention)
+@click.command('compact')
+@click.option('--days', type=int, default=None, help='Keep this many days (default: RETENTION_DAYS)')
+@with_appcontext
+def compact_command(days):
+    from flask import current_app
+    from app.retention import compact
+
+    days = days if days is not None else current_app.config['RETENTION_DAYS']
+    if days < 1:
+        raise click.UsageError('Set RETENTION_DAYS or pass --days')
+    stats = compact(days, current_app.config['COMPACTION_BATCH_SIZE'], current_app.config['COMPACTION_PAUSE'])
+    click.echo(f'Removed {stats["rows"]} rows and {stats["posts"]} posts')
+
+
+# Stream stored rows to a file (or stdout) as CSV or gzip compressed NDJSON, see app.export
+# Progress and the final throughput go to stderr, so the output can be piped
+@click.command('export')
+@click.option('--topic', default=None, help='Only this topic (default: every topic)')
+@click.option('--since', type=click.DateTime(), default=None, help='Rows saved at or after this time (UTC)')
+@click.option('--until', type=click.DateTime(), default=None, help='Rows saved before this time (UTC)')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--output', type=click.File('wb'), default='-', help='File to write (default: stdout)')
+@click.option('--chunk-size', type=int, default=5000, help='Rows fetched from the database at a time')
+@click.option('--progress-every', type=int, default=100000, help='Report progress every this many rows (0 = off)')
+@with_appcontext
+def export_command(topic, since, until, output_format, output, chunk_size, progress_every):
+    from app.export import export_results
+
+    stats = {}
+    reported = 0
+    for chunk in export_results(output_format, topic, since, until, chunk_size, stats):
+        output.write(chunk)
+        if progress_every and stats["rows"] - reported >= progress_every:
+            reported = stats["rows"]
+            click.echo(f'{stats["rows"]} rows, {stats["rows_per_sec"]:.0f} rows/s', err=True)
+    output.flush()
+    click.echo(
+        f'Exported {stats["rows"]} rows ({stats["bytes"] / 1e6:.1f} MB) in {stats["seconds"]:.2f}s, '
+        f'{stats["rows_per_sec"]:.0f} rows/s', err=True
+    )
+
+
+# Move a database from before the post table to post + score rows (see app.migrations.migrate_to_posts)
+# The app refuses to start until this has run, stop every worker first - the copy must run in one process only
+@click.command('migrate-posts')
+@click.option('--batch-size', type=int, default=5000, help='Rows copied per transaction')
+@with_appcontext
+def migrate_posts_command(batch_size):
+    from app import db
+    from app.migrations import migrate_to_posts, upgrade_database
+
+    db.create_all()
+    copied = migrate_to_posts(batch_size)
+    upgrade_database()
+    click.echo(f'Copied {copied} rows')
+
+
+# Called from create_app()
+def register_commands(app):
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(rebuild_token_counts_command)
+    app.cli.add_command(compact_command)
+    app.cli.add_command(export_command)
+    app.cli.add_command(migrate_posts_command)
@@ -0,0 +1,114 @@
+import csv
+import io
+import json
+import logging
+import time
+import zlib
+
+from app import db
+from app.models import Post, SentimentAnalysis
+
+# Streaming export of the stored results, for the /export endpoint and `flask export`
+# Rows are read from a server side cursor (yield_per -> stream_results) in chunks of chunk_size and written out
+# as they come, nothing holds more than one chunk, so memory stays flat for a dump of any size.
+#
+#   csv    - plain CSV with a header line
+#   ndjson - one JSON object per line, gzip compressed (a .ndjson.gz file)
+#
+# Every export fills a stats dictionary (rows, bytes, seconds, rows_per_sec) that the callers report
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ['csv', 'ndjson']
+FIELDS = ['id', 'topic', 'title', 'content', 'sentiment', 'score', 'created_at']
+
+# Rows written before a chunk of output is handed to the caller (one HTTP chunk / one file write)
+ROWS_PER_CHUNK = 1000
+
+
+# Plain columns instead of ORM objects: no identity map that keeps every row alive, and one JOIN for the post text
+# Ordered by id (insert order) so an export reads the primary key index from start to end
+def export_query(topic=None, since=None, until=None):
+    query = (
+        db.session.query(
+            SentimentAnalysis.id, SentimentAnalysis.topic, Post.title, Post.content,
+            SentimentAnalysis.sentiment, SentimentAnalysis.score, SentimentAnalysis.created_at
+        )
+        .join(Post, Post.id == SentimentAnalysis.post_id)
+    )
+    if topic is not None:
+        query = query.filter(SentimentAnalysis.topic == topic)
+    if since is not None:
+        query = query.filter(SentimentAnalysis.created_at >= since)
+    if until is not None:
+        query = query.filter(SentimentAnalysis.created_at < until)
+    return query.order_by(SentimentAnalysis.id)
+
+
+# Values in FIELDS order (the columns of export_query), created_at as an ISO string
+def _row_values(row):
+    values = list(row)
+    if values[-1] is not None:
+        values[-1] = values[-1].isoformat()
+    return values
+
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(_row_values(row))
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_gzip_chunks(rows):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits 31 = gzip header and trailer
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(FIELDS, _row_values(row)))))
+        if len(lines) == ROWS_PER_CHUNK:
+            lines.append('')
+            chunk = compressor.compress('\n'.join(lines).encode('utf-8'))
+            lines = []
+            if chunk:
+                yield chunk
+    if lines:
+        lines.append('')
+        yield compressor.compress('\n'.join(lines).encode('utf-8'))
+    yield compressor.flush()
+
+
+# Generator of the export as bytes chunks
+# stats - optional dictionary, filled with rows / bytes / seconds / rows_per_sec as the export goes
+def export_results(output_format, topic=None, since=None, until=None, chunk_size=5000, stats=None):
+    if output_format not in FORMATS:
+        raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+    stats = stats if stats is not None else {}
+    stats.update(rows=0, bytes=0, seconds=0.0, rows_per_sec=0.0)
+    started = time.perf_counter()
+
+    def counted(rows):
+        for row in rows:
+            stats["rows"] += 1
+            yield row
+
+    rows = counted(export_query(topic, since, until).yield_per(chunk_size))
+    chunks = _csv_chunks(rows) if output_format == 'csv' else _ndjson_gzip_chunks(rows)
+    for chunk in chunks:
+        if not chunk:
+            continue
+        stats["bytes"] += len(chunk)
+        stats["seconds"] = time.perf_counter() - started
+        stats["rows_per_sec"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+        yield chunk
+    logger.info('Exported %s rows as %s in %.2fs', stats["rows"], output_format, stats["seconds"], extra={
+        "topic": topic,
+        "rows": stats["rows"],
+        "bytes": stats["bytes"],
+        "rows_per_sec": round(stats["rows_per_sec"], 1),
+    })
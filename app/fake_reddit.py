@@ -0,0 +1,168 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# A small stand-in for praw.Reddit so the fetch -> score -> save pipeline can run without network access
+# It only has the parts fetch_reddit_data() uses: reddit.read_only, reddit.subreddit('all').search(...)
+# Posts are generated on the fly from a seeded random generator, so the same topic always gives the same posts
+
+POSITIVE_WORDS = ['good', 'great', 'love', 'amazing', 'happy', 'helpful', 'excellent', 'nice', 'best', 'enjoy']
+NEGATIVE_WORDS = ['bad', 'terrible', 'hate', 'awful', 'sad', 'broken', 'worst', 'angry', 'useless', 'poor']
+NEUTRAL_WORDS = [
+    'the', 'a', 'this', 'that', 'is', 'was', 'and', 'or', 'for', 'with', 'about', 'today', 'people',
+    'project', 'data', 'code', 'team', 'question', 'week', 'update', 'idea', 'new', 'version', 'release',
+]
+
+
+# Build one synthetic post body, sentiment words are mixed in with neutral filler
+def make_post_text(rng, topic, min_words=20, max_words=80):
+    words = []
+    for _ in range(rng.randint(min_words, max_words)):
+        roll = rng.random()
+        if roll < 0.08:
+            words.append(rng.choice(POSITIVE_WORDS))
+        elif roll < 0.14:
+            words.append(rng.choice(NEGATIVE_WORDS))
+        elif roll < 0.18:
+            words.append(topic)
+        else:
+            words.append(rng.choice(NEUTRAL_WORDS))
+    return ' '.join(words) + rng.choice(['.', '!', '?', ''])
+
+
+class FakeSubmission:
+    def __init__(self, title, selftext, url):
+        self.title = title
+        self.selftext = selftext
+        self.url = url
+
+
+class FakeSubreddit:
+    def __init__(self, name, delay=0.0, seed=0):
+        self.name = name
+        self.delay = delay
+        self.seed = seed
+        self.served = 0 # how many submissions have been handed out so far
+
+    # Same signature as praw's Subreddit.search, submissions are created one at a time as the caller iterates
+    # delay - seconds to wait before every submission, to act like a slow network
+    def search(self, query, sort='new', time_filter='all', limit=100):
+        rng = random.Random(f'{self.seed}:{query}')
+        for index in range(limit if limit is not None else 100):
+            if self.delay:
+                time.sleep(self.delay)
+            self.served += 1
+            yield FakeSubmission(
+                title=f'{query} post {index}',
+                selftext=make_post_text(rng, query),
+                url=f'https://reddit.example/{query}/{index}'
+            )
+
+
+class FakeReddit:
+    def __init__(self, delay=0.0, seed=0):
+        self.read_only = False
+        self.delay = delay
+        self.seed = seed
+        self.subreddits = {}
+
+    def subreddit(self, name):
+        if name not in self.subreddits:
+            self.subreddits[name] = FakeSubreddit(name, delay=self.delay, seed=self.seed)
+        return self.subreddits[name]
+
+
+# A local HTTP server that speaks just enough of the Reddit API for the real praw client (app.reddit_client):
+#   POST /api/v1/access_token -> an application only OAuth token
+#   GET  /r/all/search        -> a listing of generated posts (same text as FakeSubreddit.search)
+# Point the client at it with REDDIT_OAUTH_URL=REDDIT_URL=server.url
+# ratelimit_remaining / ratelimit_reset are sent back as x-ratelimit-* headers on every search response
+class FakeRedditServer:
+    def __init__(self, seed=0, delay=0.0, ratelimit_remaining=600, ratelimit_reset=600, fail_topics=()):
+        self.seed = seed
+        self.delay = delay
+        self.ratelimit_remaining = ratelimit_remaining
+        self.ratelimit_reset = ratelimit_reset
+        self.fail_topics = set(fail_topics) # searches for these answer 403
+        self.requests = [] # (method, path) of every request
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        self.thread = None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive, so connection reuse shows up in the client pool
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with server.lock:
+                    server.requests.append(('POST', urlparse(self.path).path))
+                self._send(200, {"access_token": "fake-token", "token_type": "bearer", "expires_in": 3600, "scope": "*"})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                with server.lock:
+                    server.requests.append(('GET', url.path))
+                    server.ratelimit_remaining = max(server.ratelimit_remaining - 1, 0)
+                    headers = {
+                        'x-ratelimit-remaining': str(server.ratelimit_remaining),
+                        'x-ratelimit-reset': str(server.ratelimit_reset),
+                        'x-ratelimit-used': '1',
+                    }
+                if server.delay:
+                    time.sleep(server.delay)
+                topic = query.get('q', [''])[0]
+                if not url.path.rstrip('/').endswith('/search'):
+                    return self._send(404, {"error": 404}, headers)
+                if topic in server.fail_topics:
+                    return self._send(403, {"error": 403}, headers)
+
+                limit = int(query.get('limit', ['25'])[0])
+                rng = random.Random(f'{server.seed}:{topic}')
+                children = [
+                    {"kind": "t3", "data": {
+                        "id": f'{abs(hash(topic)) % 10 ** 6:x}{index}',
+                        "title": f'{topic} post {index}',
+                        "selftext": make_post_text(rng, topic),
+                        "url": f'https://reddit.example/{topic}/{index}',
+                    }}
+                    for index in range(limit)
+                ]
+                self._send(200, {"kind": "Listing", "data": {"after": None, "children": children}}, headers)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
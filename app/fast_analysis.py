@@ -0,0 +1,246 @@
+import os
+import threading
+import numpy as np
+
+# The word lists and constants are the same ones NLTK's VADER uses, we only change how the scoring runs
+from nltk.sentiment.vader import VaderConstants
+
+# This is the "fast" sentiment engine for bulk backfills
+# NLTK's SentimentIntensityAnalyzer looks every word up in a Python dict, one post at a time
+# Here the lexicon is compiled once into a vocabulary (word -> integer id) and numpy arrays indexed by that id
+# A whole batch of posts is turned into one long array of token ids and scored with array operations
+# It follows the main VADER rules (caps emphasis, boosters, negation, "least", "but", ! and ? emphasis)
+# but skips the rare idiom rules, so scores can drift slightly from the reference engine - see parity_report()
+
+LEXICON_PATH = os.getenv(
+    'VADER_LEXICON_PATH',
+    os.path.join(os.getcwd(), 'nltk_data', 'sentiment', 'vader_lexicon', 'vader_lexicon.txt')
+)
+
+constants = VaderConstants()
+REGEX_REMOVE_PUNCTUATION = constants.REGEX_REMOVE_PUNCTUATION
+PUNC_LIST = constants.PUNC_LIST
+
+# Extra words the rules need to recognise even though they have no valence of their own
+RULE_WORDS = ['but', 'least', 'at', 'very', 'kind', 'of', 'never', 'so', 'this']
+
+_vocabulary = None
+_vocabulary_lock = threading.Lock()
+
+
+# The compiled lexicon, every array is indexed by token id and id 0 means "unknown word"
+class Vocabulary:
+    def __init__(self, lexicon_path):
+        lexicon = {}
+        with open(lexicon_path, encoding='utf-8') as lexicon_file:
+            for line in lexicon_file:
+                parts = line.strip().split('\t')
+                if len(parts) >= 2:
+                    lexicon[parts[0]] = float(parts[1])
+
+        words = list(lexicon)
+        words += [w for w in constants.BOOSTER_DICT if w not in lexicon]
+        words += [w for w in constants.NEGATE if w not in lexicon and w not in constants.BOOSTER_DICT]
+        words += [w for w in RULE_WORDS if w not in lexicon and w not in constants.BOOSTER_DICT and w not in constants.NEGATE]
+
+        self.ids = {word: index + 1 for index, word in enumerate(dict.fromkeys(words))}
+        size = len(self.ids) + 1
+
+        self.valence = np.zeros(size)
+        self.in_lexicon = np.zeros(size, dtype=bool)
+        self.booster = np.zeros(size)
+        self.negate = np.zeros(size, dtype=bool)
+        for word, index in self.ids.items():
+            if word in lexicon:
+                self.valence[index] = lexicon[word]
+                self.in_lexicon[index] = True
+            self.booster[index] = constants.BOOSTER_DICT.get(word, 0.0)
+            self.negate[index] = word in constants.NEGATE
+
+        self.but_id = self.ids['but']
+        self.least_id = self.ids['least']
+        self.at_id = self.ids['at']
+        self.very_id = self.ids['very']
+        self.kind_id = self.ids['kind']
+        self.of_id = self.ids['of']
+        self.never_id = self.ids['never']
+        self.so_or_this = np.zeros(size, dtype=bool)
+        self.so_or_this[[self.ids['so'], self.ids['this']]] = True
+
+
+# Compile the lexicon on first use, later calls reuse the same arrays
+def get_vocabulary():
+    global _vocabulary
+    if _vocabulary is None:
+        with _vocabulary_lock:
+            if _vocabulary is None:
+                _vocabulary = Vocabulary(LEXICON_PATH)
+    return _vocabulary
+
+
+# Split a text into words the same way VADER does:
+# split on whitespace, drop single characters and strip one leading or trailing punctuation mark (keeps emoticons and contractions)
+def tokenize(text):
+    tokens = []
+    for word in text.split():
+        if len(word) <= 1:
+            continue
+        stripped = REGEX_REMOVE_PUNCTUATION.sub('', word)
+        if stripped != word and len(stripped) > 1:
+            for punc in PUNC_LIST:
+                if word == punc + stripped or word == stripped + punc:
+                    word = stripped
+                    break
+        tokens.append(word)
+    return tokens
+
+
+# Turn a batch of texts into flat numpy arrays
+# ids - token id of every word, doc - which text the word belongs to, pos - position of the word inside its text
+# upper - word is ALL CAPS, negated - word is a negation word or contains "n't"
+def encode_batch(texts, vocabulary=None):
+    vocabulary = vocabulary or get_vocabulary()
+    lookup = vocabulary.ids.get
+    ids, doc, pos, upper, negated = [], [], [], [], []
+    for doc_index, text in enumerate(texts):
+        for position, word in enumerate(tokenize(text)):
+            lower = word.lower()
+            token_id = lookup(lower, 0)
+            ids.append(token_id)
+            doc.append(doc_index)
+            pos.append(position)
+            upper.append(word.isupper())
+            negated.append("n't" in lower)
+    ids = np.asarray(ids, dtype=np.int64)
+    negated = np.asarray(negated, dtype=bool) | vocabulary.negate[ids]
+    return (
+        ids,
+        np.asarray(doc, dtype=np.int64),
+        np.asarray(pos, dtype=np.int64),
+        np.asarray(upper, dtype=bool),
+        negated,
+    )
+
+
+# Score a list of texts and return a numpy array of compound scores (rounded like VADER to 4 places)
+def compound_scores(texts, vocabulary=None):
+    vocabulary = vocabulary or get_vocabulary()
+    texts = [text if isinstance(text, str) else str(text) for text in texts]
+    n_docs = len(texts)
+    if n_docs == 0:
+        return np.zeros(0)
+
+    ids, doc, pos, upper, negated = encode_batch(texts, vocabulary)
+    n_tokens = len(ids)
+    if n_tokens == 0:
+        return np.zeros(n_docs)
+
+    # is_cap_diff - some but not all words of the text are ALL CAPS
+    words_per_doc = np.bincount(doc, minlength=n_docs)
+    upper_per_doc = np.bincount(doc, weights=upper, minlength=n_docs)
+    cap_diff = ((words_per_doc - upper_per_doc) > 0) & (upper_per_doc > 0)
+    cap_token = upper & cap_diff[doc]
+
+    in_lexicon = vocabulary.in_lexicon[ids]
+    is_booster = vocabulary.booster[ids] != 0
+    next_ids = np.append(ids[1:], 0)
+    next_same_doc = np.append(doc[1:] == doc[:-1], False)
+    kind_of = (ids == vocabulary.kind_id) & next_same_doc & (next_ids == vocabulary.of_id)
+
+    # Sentiment laden words - in the lexicon, and not a booster word (those only change their neighbours)
+    scoring = in_lexicon & ~is_booster & ~kind_of
+    valence = np.where(scoring, vocabulary.valence[ids], 0.0)
+
+    # ALL CAPS emphasis on the word itself
+    valence = valence + np.where(scoring & cap_token, np.where(valence > 0, constants.C_INCR, -constants.C_INCR), 0.0)
+
+    # Look back up to three words for boosters/dampeners and negations
+    for distance, damping in ((1, 1.0), (2, 0.95), (3, 0.9)):
+        has_prev = scoring & (pos >= distance)
+        prev = np.clip(np.arange(n_tokens) - distance, 0, None)
+        prev_ids = ids[prev]
+        applies = has_prev & ~vocabulary.in_lexicon[prev_ids]
+
+        scalar = vocabulary.booster[prev_ids] * np.where(valence < 0, -1.0, 1.0)
+        booster_caps = (vocabulary.booster[prev_ids] != 0) & cap_token[prev]
+        scalar = scalar + np.where(booster_caps, np.where(valence > 0, constants.C_INCR, -constants.C_INCR), 0.0)
+        valence = valence + np.where(applies, scalar * damping, 0.0)
+
+        # "never so good" / "never this good" make the word stronger instead of negating it
+        # The words after prev are clipped to the last token so short batches stay in bounds,
+        # wherever this rule applies (pos >= distance) they are inside the same post anyway
+        after1 = np.minimum(prev + 1, n_tokens - 1)
+        after2 = np.minimum(prev + 2, n_tokens - 1)
+        if distance == 1:
+            emphasis = np.zeros(n_tokens, dtype=bool)
+        elif distance == 2:
+            emphasis = (ids[prev] == vocabulary.never_id) & vocabulary.so_or_this[ids[after1]]
+        else:
+            emphasis = ((ids[prev] == vocabulary.never_id) & vocabulary.so_or_this[ids[after1]]) | vocabulary.so_or_this[ids[after2]]
+        multiplier = np.where(emphasis, 1.5 if distance == 2 else 1.25, np.where(negated[prev], constants.N_SCALAR, 1.0))
+        valence = np.where(applies, valence * multiplier, valence)
+
+    # "least" works as a negation unless it is "at least" / "very least"
+    prev1 = np.clip(np.arange(n_tokens) - 1, 0, None)
+    prev2 = np.clip(np.arange(n_tokens) - 2, 0, None)
+    least_before = scoring & (pos >= 1) & (ids[prev1] == vocabulary.least_id)
+    excused = (pos >= 2) & ((ids[prev2] == vocabulary.at_id) | (ids[prev2] == vocabulary.very_id))
+    valence = np.where(least_before & ~excused, valence * constants.N_SCALAR, valence)
+
+    # "but" - words before the first "but" count half, words after count one and a half times
+    first_but = np.full(n_docs, np.iinfo(np.int64).max)
+    but_tokens = ids == vocabulary.but_id
+    np.minimum.at(first_but, doc[but_tokens], pos[but_tokens])
+    has_but = first_but[doc] != np.iinfo(np.int64).max
+    valence = np.where(has_but & (pos < first_but[doc]), valence * 0.5, valence)
+    valence = np.where(has_but & (pos > first_but[doc]), valence * 1.5, valence)
+
+    sums = np.bincount(doc, weights=valence, minlength=n_docs)
+
+    # Emphasis from exclamation points (max 4) and question marks (2 or more)
+    ep = np.minimum([text.count('!') for text in texts], 4) * 0.292
+    qm_count = np.asarray([text.count('?') for text in texts])
+    qm = np.where(qm_count > 3, 0.96, np.where(qm_count > 1, qm_count * 0.18, 0.0))
+    sums = sums + np.sign(sums) * (ep + qm)
+
+    # Normalize to -1..1 the same way VADER does: x / sqrt(x^2 + 15)
+    compound = sums / np.sqrt(sums * sums + 15)
+    compound = np.where(words_per_doc > 0, compound, 0.0)
+    return np.round(compound, 4)
+
+
+# Fast version of analyse_sentiment(), returns the same list of dictionaries
+def analyse_sentiment_fast(posts):
+    posts = list(posts)
+    scores = compound_scores([post['content'] for post in posts])
+    results = []
+    for post, score in zip(posts, scores.tolist()):
+        results.append({
+            "title": post['title'],
+            "content": post['content'],
+            "sentiment": 'POSITIVE' if score >= 0 else 'NEGATIVE',
+            "score": score
+        })
+    return results
+
+
+# Compare the fast engine against the reference VADER engine on the same posts
+# label_agreement - share of posts that get the same POSITIVE/NEGATIVE label
+# mean_abs_diff / max_abs_diff - how far the compound scores drift apart
+def parity_report(posts):
+    from app.analysis import analyse_sentiment
+
+    posts = list(posts)
+    reference = analyse_sentiment(posts)
+    fast = analyse_sentiment_fast(posts)
+    if not posts:
+        return {"count": 0, "label_agreement": 1.0, "mean_abs_diff": 0.0, "max_abs_diff": 0.0}
+
+    diffs = np.abs(np.asarray([r['score'] for r in reference]) - np.asarray([f['score'] for f in fast]))
+    agreement = sum(r['sentiment'] == f['sentiment'] for r, f in zip(reference, fast)) / len(posts)
+    return {
+        "count": len(posts),
+        "label_agreement": agreement,
+        "mean_abs_diff": float(diffs.mean()),
+        "max_abs_diff": float(diffs.max()),
+    }
@@ -1,22 +1,78 @@
 import os
-import matplotlib
-import seaborn as sns
-from wordcloud import WordCloud
+import hashlib
+import json
+import threading
 import base64
 from io import BytesIO
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict
 import re
-matplotlib.use('Agg')  # We are using aggrigrate functions for rendering GUI aggrigations
-import matplotlib.pyplot as plt  # for saving the figure into the directory
 
+# matplotlib, seaborn and wordcloud take most of a second to import, so they are only imported
+# the first time a chart is drawn (or ahead of time by app.prewarm), not when the app starts
+def load_plotting():
+    import matplotlib
+    matplotlib.use('Agg')  # We are using aggrigrate functions for rendering GUI aggrigations
+    import seaborn as sns
+    from matplotlib.figure import Figure  # Object oriented figure API - every call gets its own figure, no shared pyplot state
+    from wordcloud import WordCloud
+    return sns, Figure, WordCloud
+
+# Rendered images are kept in memory, keyed by a digest of the sentiment results and the topic
+# so the same result set never renders the bar chart or the word cloud twice
+# GRAPH_CACHE_SIZE - how many rendered (bar chart, word cloud) pairs are kept
+_graph_cache = OrderedDict()
+_graph_cache_lock = threading.Lock()
+GRAPH_CACHE_SIZE = int(os.getenv('GRAPH_CACHE_SIZE', 128))
+
+
+# Digest of everything the two images depend on
+# The bar chart only needs the labels and scores. With pre-aggregated word_counts the word cloud only needs those,
+# so the post text is hashed only in the fallback case where the words are counted from the contents
+def results_digest(sentiment_results, topic, word_counts=None):
+    if word_counts:
+        rows = [[result['sentiment'], result['score']] for result in sentiment_results]
+        words = sorted(word_counts.items())
+    else:
+        rows = [[result['sentiment'], result['score'], result['content']] for result in sentiment_results]
+        words = None
+    payload = json.dumps([topic, rows, words], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Save a matplotlib figure or a PIL image straight into memory and return it as base64
+def encode_figure_to_base64(figure):
+    buffer = BytesIO()
+    figure.savefig(buffer, format='png')
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+def encode_pil_image_to_base64(image):
+    buffer = BytesIO()
+    image.save(buffer, format='png', optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+# generate_graphs() returns the cached images if this exact result set was rendered before
+# word_counts - optional pre-aggregated {word: count} for the word cloud (see app.token_counts),
+#               when it is not given the words are counted from the result contents
+def generate_graphs(sentiment_results, topic, word_counts=None):
+    digest = results_digest(sentiment_results, topic, word_counts)
+    with _graph_cache_lock:
+        if digest in _graph_cache:
+            _graph_cache.move_to_end(digest)
+            return _graph_cache[digest]
+
+    images = render_graphs(sentiment_results, topic, word_counts)
+
+    with _graph_cache_lock:
+        _graph_cache[digest] = images
+        while len(_graph_cache) > GRAPH_CACHE_SIZE:
+            _graph_cache.popitem(last=False)
+    return images
+
+
+def render_graphs(sentiment_results, topic, word_counts=None):
+    sns, Figure, WordCloud = load_plotting()
 
-# Create the directory for the images:
-def create_directory(path):
-    if not os.path.exists(path):
-        os.makedirs(path)
-
-
-def generate_graphs(sentiment_results, topic):
     # extract sentiment label and scores
     # Here we will use list comprehensions
     sentiment = [result['sentiment'] for result in sentiment_results]  
@@ -36,22 +92,19 @@ def generate_graphs(sentiment_results, topic):
     sentiments = list(sentiment_score_map.keys())
     avg_scores = [sum(values) / len(values) for values in sentiment_score_map.values()]
 
-    images_dir = os.path.join('static', 'images')  
-    # static directory is used for images and templates directory is for all the html templates
-    create_directory(images_dir)
-
-    bar_chart_path = os.path.join(images_dir, 'sentiment_bar_chart.png')
-    word_cloud_path = os.path.join(images_dir, 'word_cloud.png')
-
     # define bar plots:
-    plt.figure(figsize=(10, 6))
-    ax = sns.barplot(x=sentiments, y=avg_scores, palette='coolwarm')
-
-    plt.title(f'Sentiment Scores for the Reddit Posts on "{topic}"', fontsize=16)
-    plt.xlabel('Sentiment', fontsize=12)
-    plt.ylabel('Average Score', fontsize=12)
-    plt.xticks(rotation=45, ha="right")
-    plt.tight_layout()
+    # A new Figure object per call (instead of the global plt.figure()) so concurrent requests never draw on each other's chart
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    sns.barplot(x=sentiments, y=avg_scores, palette='coolwarm', ax=ax)
+
+    ax.set_title(f'Sentiment Scores for the Reddit Posts on "{topic}"', fontsize=16)
+    ax.set_xlabel('Sentiment', fontsize=12)
+    ax.set_ylabel('Average Score', fontsize=12)
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+    fig.tight_layout()
 
     # Add data labels on top of the bars
     for p in ax.patches:
@@ -67,25 +120,24 @@ def generate_graphs(sentiment_results, topic):
         )
 
     # Add gridlines for better readability
-    plt.grid(True, linestyle='--', alpha=0.7)
+    ax.grid(True, linestyle='--', alpha=0.7)
 
-    # Save the bar plot to a PNG file
-    plt.savefig(bar_chart_path)
-    plt.close()  # Close the plot to avoid memory issues
-
-    # Convert the bar chart to base64 for returning in the response
-    bar_chart_64 = encode_image_to_base64(bar_chart_path)
+    # Render the bar plot into an in-memory PNG and convert it to base64 for returning in the response
+    # No file on disk, the figure is simply dropped after this function
+    bar_chart_64 = encode_figure_to_base64(fig)
 
     # Generate word cloud from most frequent words in content
-    text = ' '.join([result['content'] for result in sentiment_results])
+    # Normally the counts come pre-aggregated from the topic_token_count table, this is the fallback
+    if not word_counts:
+        text = ' '.join([result['content'] for result in sentiment_results])
 
-    # Clean the text (remove special characters, numbers, etc.)
-    text = re.sub(r'[^A-Za-z\s]', '', text.lower())  
-    # Remove non-alphabetic characters and make lowercase
+        # Clean the text (remove special characters, numbers, etc.)
+        text = re.sub(r'[^A-Za-z\s]', '', text.lower())  
+        # Remove non-alphabetic characters and make lowercase
 
-    # Tokenize the text into words and count frequency
-    words = text.split()
-    word_counts = Counter(words)
+        # Tokenize the text into words and count frequency
+        words = text.split()
+        word_counts = Counter(words)
 
     # Generate the word cloud from the most frequent words
     wordcloud = WordCloud(
@@ -96,16 +148,7 @@ def generate_graphs(sentiment_results, topic):
         colormap='viridis'
     ).generate_from_frequencies(word_counts)
 
-    # Save the word cloud to a PNG file
-    wordcloud.to_file(word_cloud_path)
-
-    # Convert the word cloud image to base64 for returning in the response
-    word_cloud_b64 = encode_image_to_base64(word_cloud_path)
+    # Render the word cloud image in memory and convert it to base64 for returning in the response
+    word_cloud_b64 = encode_pil_image_to_base64(wordcloud.to_image())
 
     return bar_chart_64, word_cloud_b64
-
-
-def encode_image_to_base64(imagepath):
-    with open(imagepath, "rb") as img_file:
-        img_64 = base64.b64encode(img_file.read()).decode("utf-8")
-    return img_64
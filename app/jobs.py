@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app.service import build_analysis
+from app.result_cache import analysis_key, get_or_compute, normalize_topic
+
+# Asynchronous job mode for /analyze
+# A cold analysis (Reddit fetch, scoring, DB writes, chart rendering) can take a long time and used to block
+# a Flask worker thread for all of it. With jobs the POST only queues the work and returns a job id at once,
+# a small bounded pool of background threads does the work, and the client polls the status endpoint.
+# A second submission for the same topic + limit while the first is still running gets the same job back.
+# Jobs share the result cache of /analyze (app.result_cache): a cached analysis is returned at once,
+# and a job's result is cached for the HTML route too.
+
+logger = logging.getLogger(__name__)
+
+
+# Raised when too many jobs are waiting, the route answers 503 so clients back off
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, topic, limit):
+        self.id = uuid.uuid4().hex
+        self.topic = topic
+        self.limit = limit
+        self.status = 'queued' # queued -> running -> done / failed
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    # progress(stage, fraction) callback handed to build_analysis()
+    def update(self, stage, fraction):
+        self.stage = stage
+        self.progress = fraction
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "topic": self.topic,
+            "num_records": self.limit,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+        }
+        if self.status == 'done':
+            data["result"] = self.result
+        if self.status == 'failed':
+            data["error"] = self.error
+        return data
+
+
+# Keeps track of every job and runs them on a bounded thread pool
+# Set up like the other extensions: jobs = JobManager() here, jobs.init_app(app) in create_app()
+#   JOB_WORKERS - background threads running jobs
+#   JOB_MAX_PENDING - queued + running jobs allowed before new submissions are refused
+#   JOB_RESULT_TTL - seconds a finished job (and its result) is kept for polling
+class JobManager:
+    def __init__(self):
+        self.workers = 2
+        self.max_pending = 32
+        self.result_ttl = 3600
+        self.executor = None
+        self.jobs = {}
+        self.in_flight = {} # (normalized topic, limit) -> job id of the queued/running job
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.workers = app.config.get('JOB_WORKERS', self.workers)
+        self.max_pending = app.config.get('JOB_MAX_PENDING', self.max_pending)
+        self.result_ttl = app.config.get('JOB_RESULT_TTL', self.result_ttl)
+        app.extensions['jobs'] = self
+
+    # Called with the lock held, so two first submissions at the same time cannot start two pools
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analyze-job')
+        return self.executor
+
+    # Forget finished jobs older than JOB_RESULT_TTL (called with the lock held)
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    # Queue an analysis, returns (job, created) - created is False when an in-flight job for the same topic+limit was reused
+    def submit(self, topic, limit):
+        key = (normalize_topic(topic), limit)
+        app = current_app._get_current_object()
+        with self.lock:
+            self._expire()
+            existing = self.jobs.get(self.in_flight.get(key))
+            if existing is not None and existing.status in ('queued', 'running'):
+                return existing, False
+            if len(self.in_flight) >= self.max_pending:
+                raise QueueFullError('Too many analysis jobs are waiting, try again later')
+
+            job = Job(topic, limit)
+            self.jobs[job.id] = job
+            self.in_flight[key] = job.id
+            self._get_executor().submit(self._run, app, job, key)
+        return job, True
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    # Runs on a background thread - needs its own app context for the database and the config
+    def _run(self, app, job, key):
+        job.status = 'running'
+        try:
+            with app.app_context():
+                job.result = get_or_compute(
+                    analysis_key(job.topic, job.limit),
+                    lambda: build_analysis(job.topic, job.limit, progress=job.update)
+                )
+            job.update('done', 1.0) # a cached result never reported any progress
+            job.status = 'done'
+        except Exception as e:
+            logger.exception('Analyze job %s for %s failed', job.id, job.topic)
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self.lock:
+                if self.in_flight.get(key) == job.id:
+                    del self.in_flight[key]
+
+    # Wait for running jobs and stop the threads (used by tests and on shutdown)
+    def shutdown(self, wait=True):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+jobs = JobManager()
@@ -1,17 +1,202 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-def configure_logger():
+from flask import g, has_request_context, request
+
+# Logging for the whole app package
+# Every logger under 'app' (app.logger, app.result_cache, app.prewarm, ...) ends up in logs/app.log as one JSON object per line
+#
+# Nothing is written in the request thread: records go into an in-memory queue (QueueHandler) and a background
+# QueueListener thread formats them and writes the file. If the queue is ever full a record is dropped instead
+# of making the request wait. configure_logger() can be called any number of times, it only sets this up once.
+#
+# Settings (environment variables, logging is set up before the app config exists):
+#   LOG_DIR / LOG_LEVEL           - folder of app.log, minimum level (default INFO)
+#   LOG_MAX_BYTES / LOG_BACKUPS   - app.log is rotated at this size, this many old files are kept
+#   LOG_QUEUE_SIZE                - records waiting for the writer thread before new ones are dropped
+#   LOG_RATE_LIMIT / LOG_RATE_WINDOW - the same message (below WARNING) is logged at most this many times per window (seconds)
+#   LOG_SAMPLE_EVERY              - over the limit only every n-th record is kept, it carries the count it stands for
+
+# Attributes every LogRecord has, anything else on a record came from extra={...} and is written to the JSON
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+# One JSON object per record
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+# Adds the request id, method, path and the stage timings so far (app.metrics) to records logged during a request
+# Runs in the request thread, before the record is queued, because flask.g only exists there
+class RequestContextFilter(logging.Filter):
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.path = request.path
+            durations = g.get('stage_durations')
+            if durations:
+                record.stage_durations = {name: round(seconds, 4) for name, seconds in durations.items()}
+        return True
+
+
+# Keeps a noisy message from flooding the log
+# Records are grouped by logger, level and message template; in every window of `window` seconds the first `limit`
+# records of a group pass, after that only every `sample_every`-th one, with sampled=<records it stands for>.
+# WARNING and above always pass, and so do records logged with extra={"_rate_limit": False}
+# (the one summary line per request - it is the only record with the request id, status and stage timings)
+class RateLimitFilter(logging.Filter):
+    def __init__(self, limit=50, window=10.0, sample_every=100):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.sample_every = sample_every
+        self.groups = {} # (logger, level, template) -> [window start, records seen in the window]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, '_rate_limit', True):
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None or now - group[0] >= self.window:
+                if len(self.groups) > 10000:
+                    self.groups.clear() # many different templates, start over instead of growing forever
+                group = self.groups[key] = [now, 0]
+            group[1] += 1
+            seen = group[1]
+        if seen <= self.limit:
+            return True
+        if (seen - self.limit) % self.sample_every == 0:
+            record.sampled = self.sample_every
+            return True
+        return False
+
+
+# QueueHandler that never blocks: a full queue drops the record and counts it
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    # Merge the arguments into the message and turn the exception into text in the request thread,
+    # so the queued record holds no references to live objects (the writer thread formats it later)
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# Set up the queue, the writer thread and the rotating file once, returns the 'app.logger' logger
+def configure_logger(log_dir=None):
+    global _listener, _queue_handler
     logger = logging.getLogger(__name__)
-    log_dir = 'logs'
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-
-    log_file = os.path.join(log_dir, 'app.log')
-    handler = logging.FileHandler(log_file)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
+    with _lock:
+        if _listener is not None:
+            return logger
+
+        log_dir = log_dir or os.getenv('LOG_DIR', 'logs')
+        os.makedirs(log_dir, exist_ok=True)
+        file_handler = RotatingFileHandler(
+            os.path.join(log_dir, 'app.log'),
+            maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+            backupCount=int(os.getenv('LOG_BACKUPS', 5)),
+            encoding='utf-8',
+        )
+        file_handler.setFormatter(JsonFormatter())
+
+        log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _queue_handler.addFilter(RequestContextFilter())
+        _queue_handler.addFilter(RateLimitFilter(
+            limit=int(os.getenv('LOG_RATE_LIMIT', 50)),
+            window=float(os.getenv('LOG_RATE_WINDOW', 10)),
+            sample_every=int(os.getenv('LOG_SAMPLE_EVERY', 100)),
+        ))
+        _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+
+        package_logger = logging.getLogger('app')
+        package_logger.addHandler(_queue_handler)
+        package_logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
     return logger
 
+
+# Write out every queued record and stop the writer thread (at exit, and in tests before reading the file)
+# The next configure_logger() call sets everything up again
+def shutdown_logging():
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        logging.getLogger('app').removeHandler(_queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        _queue_handler = None
+
+atexit.register(shutdown_logging)
+
+
+# Request ids and one summary line per request, called from create_app()
+# The id comes from the X-Request-ID header when a proxy already set one, it is sent back in the response
+def init_request_logging(app):
+    logger = configure_logger()
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_logged_at = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        response.headers['X-Request-ID'] = g.get('request_id', '')
+        started = g.get('request_logged_at')
+        if started is not None:
+            logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+                "status": response.status_code,
+                "duration": round(time.perf_counter() - started, 4),
+                "_rate_limit": False, # every request gets its line, however busy the app is
+            })
+        return response
@@ -0,0 +1,229 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, g, has_request_context, request
+
+# Latency metrics for the analysis stages and the HTTP requests, served as Prometheus text on /metrics
+#
+#   with stage('score'):       - times one stage (fetch, db_query, score, db_write, token_counts, render_graphs, template)
+#   timed_iter(posts, 'fetch') - times how long a generator keeps its caller waiting (the Reddit fetch is a generator)
+#   metrics.cache_requests.inc(result='hit') - result cache lookups by outcome (hit, stale, miss, coalesced)
+#   metrics.warmer_refreshes.inc(result='refreshed') - hot topics the cache warmer refreshed / skipped / failed on
+#
+# The numbers live in the memory of each worker process (every gunicorn worker answers /metrics with its own numbers),
+# Prometheus adds them up per instance label.
+#
+# Slow request profiling (off by default):
+#   METRICS_PROFILE_THRESHOLD   - seconds, requests slower than this have their cProfile written out (0 = off)
+#   METRICS_PROFILE_SAMPLE_RATE - share of requests that run under the profiler (profiling slows a request down)
+#   METRICS_PROFILE_DIR         - where the .prof files go, open them with `python -m pstats` or snakeviz
+
+# Default latency buckets in seconds, from a cache hit (few ms) to a cold Reddit fetch (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {} # label values -> count
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(str(labels.get(name, '')) for name in self.labelnames), 0)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(zip(self.labelnames, key))} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {} # label values -> [count per bucket..., total count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * len(self.buckets) + [0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self.values.get(tuple(str(labels.get(name, '')) for name in self.labelnames))
+        return series[-2] if series else 0
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                labels = list(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", repr(float(bound)))])} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", "+Inf")])} {series[-2]}')
+                lines.append(f'{self.name}_sum{_format_labels(labels)} {series[-1]}')
+                lines.append(f'{self.name}_count{_format_labels(labels)} {series[-2]}')
+        return lines
+
+
+# Every metric of the app, set up like the other extensions: metrics.init_app(app) in create_app()
+class Metrics:
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            'sentinal_stage_seconds', 'Time spent in each stage of an analysis', ['stage']
+        )
+        self.request_seconds = Histogram(
+            'sentinal_request_seconds', 'HTTP request latency', ['endpoint', 'method']
+        )
+        self.requests = Counter(
+            'sentinal_requests_total', 'HTTP requests by endpoint and status code', ['endpoint', 'method', 'status']
+        )
+        self.cache_requests = Counter(
+            'sentinal_result_cache_requests_total', 'Result cache lookups of /analyze by outcome', ['result']
+        )
+        self.warmer_refreshes = Counter(
+            'sentinal_cache_warmer_refreshes_total', 'Hot topics refreshed by the cache warmer by outcome', ['result']
+        )
+        self.profiles = Counter(
+            'sentinal_slow_request_profiles_total', 'cProfile dumps written for slow requests', ['endpoint']
+        )
+        self.profile_threshold = 0.0
+        self.profile_sample_rate = 0.0
+        self.profile_dir = 'profiles'
+
+    def all(self):
+        return [
+            self.stage_seconds, self.request_seconds, self.requests, self.cache_requests, self.warmer_refreshes,
+            self.profiles,
+        ]
+
+    def render(self):
+        lines = []
+        for metric in self.all():
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+    def init_app(self, app):
+        self.profile_threshold = app.config.get('METRICS_PROFILE_THRESHOLD', self.profile_threshold)
+        self.profile_sample_rate = app.config.get('METRICS_PROFILE_SAMPLE_RATE', self.profile_sample_rate)
+        self.profile_dir = app.config.get('METRICS_PROFILE_DIR', self.profile_dir)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.register_blueprint(metrics_bp)
+        app.extensions['metrics'] = self
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+        g.profiler = None
+        if self.profile_threshold and random.random() < self.profile_sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g.profiler = profiler
+            except ValueError:
+                pass # another profiler is already running on this thread
+
+    def _after_request(self, response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        seconds = time.perf_counter() - started
+        endpoint = request.endpoint or 'unknown'
+        self.request_seconds.observe(seconds, endpoint=endpoint, method=request.method)
+        self.requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if seconds >= self.profile_threshold:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                filename = f'{endpoint.replace(".", "_")}-{int(time.time() * 1000)}-{seconds:.2f}s.prof'
+                profiler.dump_stats(os.path.join(self.profile_dir, filename))
+                self.profiles.inc(endpoint=endpoint)
+        return response
+
+    # A view that raised never reaches after_request, make sure its profiler does not stay switched on
+    def _teardown_request(self, error=None):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+
+metrics = Metrics()
+
+
+# Add one stage duration to the histogram, and to g.stage_durations of the current request
+def record_stage(name, seconds):
+    metrics.stage_seconds.observe(seconds, stage=name)
+    if has_request_context():
+        durations = g.setdefault('stage_durations', {})
+        durations[name] = durations.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+# Pass the items of an iterable through and record the total time spent waiting for them as one stage
+def timed_iter(iterable, name):
+    iterator = iter(iterable)
+    waited = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                waited += time.perf_counter() - start
+            yield item
+    finally:
+        record_stage(name, waited)
+
+
+# /metrics is mounted at the root of the app (not under /api/sentiment) where scrapers look for it
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
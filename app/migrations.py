@@ -0,0 +1,139 @@
+from sqlalchemy import inspect, insert, text
+
+from app import db
+from app.models import SentimentAnalysis, post_hash
+from app.search import install_search_index
+
+# Small schema upgrades for databases that already exist
+# db.create_all() only creates missing tables, it never adds new indexes to a table that is already there,
+# so every statement here is written to be safe to run again and again (IF NOT EXISTS)
+#
+# On PostgreSQL indexes are built with CREATE INDEX CONCURRENTLY, a plain CREATE INDEX blocks every write
+# to the table until the build is done, which on a big sentiment_analysis table can take minutes.
+# CONCURRENTLY cannot run inside a transaction, so those statements run in autocommit mode.
+# If a concurrent build is interrupted PostgreSQL leaves an INVALID index behind - drop it and run this again.
+
+# (index name, table, columns)
+INDEXES = [
+    # Composite index for: WHERE topic = ? ORDER BY created_at DESC LIMIT n
+    ('ix_sentiment_analysis_topic_created_at', 'sentiment_analysis', 'topic, created_at'),
+    # Keyset pagination of the results API: WHERE topic = ? AND id < ? ORDER BY id DESC
+    ('ix_sentiment_analysis_topic_id', 'sentiment_analysis', 'topic, id'),
+    # Retention (app.retention): WHERE created_at < ?
+    ('ix_sentiment_analysis_created_at', 'sentiment_analysis', 'created_at'),
+    # Compaction: posts that no sentiment_analysis row refers to any more
+    ('ix_sentiment_analysis_post_id', 'sentiment_analysis', 'post_id'),
+]
+
+LEGACY_TABLE = 'sentiment_analysis_legacy'
+
+# Search index, triggers and indexes of the old sentiment_analysis table (index names are global to the schema,
+# so they have to go before the new table can create its own)
+LEGACY_DROP_STATEMENTS = {
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS sentiment_analysis_fts_insert',
+        'DROP TRIGGER IF EXISTS sentiment_analysis_fts_delete',
+        'DROP TRIGGER IF EXISTS sentiment_analysis_fts_update',
+        'DROP TABLE IF EXISTS sentiment_analysis_fts',
+        'DROP INDEX IF EXISTS ix_sentiment_analysis_topic_created_at',
+        'DROP INDEX IF EXISTS ix_sentiment_analysis_topic_id',
+    ],
+    'postgresql': [
+        'DROP INDEX IF EXISTS ix_sentiment_analysis_search',
+        'DROP INDEX IF EXISTS ix_sentiment_analysis_topic_created_at',
+        'DROP INDEX IF EXISTS ix_sentiment_analysis_topic_id',
+        f'ALTER INDEX IF EXISTS sentiment_analysis_pkey RENAME TO {LEGACY_TABLE}_pkey',
+        f'ALTER SEQUENCE IF EXISTS sentiment_analysis_id_seq RENAME TO {LEGACY_TABLE}_id_seq',
+    ],
+}
+
+
+def _index_statement(dialect, name, table, columns):
+    concurrently = 'CONCURRENTLY ' if dialect == 'postgresql' else ''
+    return f'CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns})'
+
+
+# Move a sentiment_analysis table from before the post table (title and content on every row) to
+# post + score rows: every distinct post is saved once and the rows keep their id, topic, score and created_at
+# The old table is renamed to sentiment_analysis_legacy and copied over in batches of batch_size rows,
+# each batch is its own short transaction. An interrupted copy carries on where it stopped on the next run.
+# Run it from one process only (`flask migrate-posts`), with the app stopped. Returns the number of rows copied
+def migrate_to_posts(batch_size=5000):
+    from app.persistence import save_posts
+
+    dialect = db.engine.dialect.name
+    inspector = inspect(db.engine)
+    if 'content' in {column['name'] for column in inspector.get_columns('sentiment_analysis')}:
+        with db.engine.begin() as connection:
+            for statement in LEGACY_DROP_STATEMENTS.get(dialect, []):
+                connection.execute(text(statement))
+            connection.execute(text(f'ALTER TABLE sentiment_analysis RENAME TO {LEGACY_TABLE}'))
+        db.create_all() # the new sentiment_analysis table
+    elif not inspector.has_table(LEGACY_TABLE):
+        return 0
+
+    copied = 0
+    last_id = db.session.query(db.func.max(SentimentAnalysis.id)).scalar() or 0
+    while True:
+        rows = db.session.execute(
+            text(f'SELECT id, topic, title, content, sentiment, score, created_at FROM {LEGACY_TABLE} '
+                 'WHERE id > :last_id ORDER BY id LIMIT :batch_size').columns(created_at=db.DateTime),
+            {"last_id": last_id, "batch_size": batch_size}
+        ).mappings().all()
+        if not rows:
+            break
+        hashes = [post_hash(row['title'], row['content']) for row in rows]
+        post_ids = save_posts([(content_hash, row['title'], row['content']) for content_hash, row in zip(hashes, rows)])
+        db.session.execute(insert(SentimentAnalysis), [
+            {
+                "id": row['id'],
+                "topic": row['topic'],
+                "post_id": post_ids[content_hash],
+                "sentiment": row['sentiment'],
+                "score": row['score'],
+                "created_at": row['created_at'],
+            }
+            for content_hash, row in zip(hashes, rows)
+        ])
+        db.session.commit()
+        copied += len(rows)
+        last_id = rows[-1]['id']
+
+    db.session.execute(text(f'DROP TABLE {LEGACY_TABLE}'))
+    if dialect == 'postgresql':
+        # The ids were copied as they were, move the sequence past them
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('sentiment_analysis', 'id'), coalesce(max(id), 0) + 1, false) "
+            "FROM sentiment_analysis"
+        ))
+    db.session.commit()
+    return copied
+
+
+# True when the database still has the sentiment_analysis table from before the post table (or a copy that
+# was interrupted), a schema check only - the copy itself is `flask migrate-posts`
+def posts_migration_pending():
+    inspector = inspect(db.engine)
+    if inspector.has_table(LEGACY_TABLE):
+        return True
+    if not inspector.has_table('sentiment_analysis'):
+        return False
+    return 'content' in {column['name'] for column in inspector.get_columns('sentiment_analysis')}
+
+
+# Run every schema upgrade, call this inside an app context after db.create_all()
+# Safe to run from every worker at startup: only IF NOT EXISTS statements, no data is copied here
+def upgrade_database():
+    dialect = db.engine.dialect.name
+    # Moving the post text into the post table copies every row, that is done once by hand, not at startup
+    if posts_migration_pending():
+        raise RuntimeError(
+            'The sentiment_analysis table still stores the post text, '
+            'run `flask --app app:create_app migrate-posts` once before starting the app'
+        )
+    with db.engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        for name, table, columns in INDEXES:
+            connection.execute(text(_index_statement(dialect, name, table, columns)))
+        # Full text search index over the stored posts (FTS5 on SQLite, tsvector + GIN on PostgreSQL)
+        install_search_index(connection)
@@ -1,6 +1,7 @@
 # Imports the same database object which is in __init__.py file
 from app import db
 from datetime import datetime
+import hashlib
 # This code defines a database table using Python, so Flask + SQLAlchemy know how to store sentiment data in the database of THIS app.
 # You are creating a table design using a Python class.
 # SentimentAnalysis → name of the table model
@@ -8,20 +9,126 @@ from datetime import datetime
 # This is where “knows which app to use” comes in Because earlier you did: db.init_app(app), db already knows which Flask app, So db.Model knows which database configuration to use
 # Overall the below code says : This table belongs to THAT Flask app’s database.
 
+# Every distinct post is stored once here, keyed by a hash of its title and content
+# The same Reddit post is fetched again for every topic it matches and on every refresh, before this table
+# its full text was copied into sentiment_analysis each time
+class Post(db.Model):
+    __tablename__ = 'post'
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True) # post_hash(title, content)
+    title = db.Column(db.Text, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, server_default = db.func.now()) # first time the post was saved
+
+    def __repr__(self):
+        return f'<Post: {self.title}>'
+
+
+# sha256 of title + content, the key of the post table
+# The title is part of it because link posts all share the same placeholder content ('No content Available')
+def post_hash(title, content):
+    return hashlib.sha256(f'{title}\0{content}'.encode('utf-8')).hexdigest()
+
+
 class SentimentAnalysis(db.Model): # Creating the SentimentAnalysis class which is inheriting the db.model class
     __tablename__ = 'sentiment_analysis' # The table name in the database will be: sentiment_analysis
     # Each line below is one column in the table
+    # One row per post per topic per fetch - the score, and a reference to the post text in the post table
     id = db.Column(db.Integer, primary_key=True)
     topic = db.Column(db.String(255), nullable=False) # nullable=False cannot be empty
-    title = db.Column(db.Text, nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
     sentiment = db.Column(db.String(10), nullable=False)
     score = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, server_default = db.func.now()) # Stores date and time, Automatically filled when row is created, 
 
+    # The post is loaded in the same query (JOIN), so record.title / record.content cost no extra query
+    post = db.relationship('Post', lazy='joined')
+
+    # Composite index for the read path: filter_by(topic=...).order_by(created_at.desc()).limit(n)
+    # Without it the database scans the whole table once it grows, existing databases get it from app.migrations
+    # (topic, id) serves the cursor pagination of the JSON results API (app.persistence.page_results)
+    # created_at serves the retention job (app.retention), post_id finds the posts nothing refers to any more
+    __table_args__ = (
+        db.Index('ix_sentiment_analysis_topic_created_at', 'topic', 'created_at'),
+        db.Index('ix_sentiment_analysis_topic_id', 'topic', 'id'),
+        db.Index('ix_sentiment_analysis_created_at', 'created_at'),
+        db.Index('ix_sentiment_analysis_post_id', 'post_id'),
+    )
+
+    # SentimentAnalysis(topic=..., title=..., content=..., sentiment=..., score=...) still works:
+    # the post with that title and content is reused if it is already stored, otherwise a new one is added
+    # (bulk writes go through app.persistence.bulk_insert_results, which does the same with one query per chunk)
+    def __init__(self, title=None, content=None, **kwargs):
+        super().__init__(**kwargs)
+        if title is not None or content is not None:
+            content_hash = post_hash(title, content)
+            with db.session.no_autoflush:
+                post = Post.query.filter_by(content_hash=content_hash).first()
+            self.post = post or Post(content_hash=content_hash, title=title, content=content)
+
+    @property
+    def title(self):
+        return self.post.title if self.post else None
+
+    @property
+    def content(self):
+        return self.post.content if self.post else None
+
     # To represent the object you have to define the representer
     # This code decides how an object looks when you print it or see it in debugging
     # __repr__ defines a human-readable string representation of an object for debugging and logging purposes.
     # Here self is the object which is created for the above class
     def __repr__(self):
-        return f'<Sentiment Analysis: {self.title}>'
\ No newline at end of file
+        return f'<Sentiment Analysis: {self.title}>'
+
+
+# Persistent tier of the score cache (see app.score_cache)
+# One row per (post content hash, scoring engine version), so a post that was already scored under any topic is never scored again
+# engine_version changes when the lexicon file or the scoring engine changes, old rows are then ignored and can be purged
+class ScoreCache(db.Model):
+    __tablename__ = 'score_cache'
+    content_hash = db.Column(db.String(64), primary_key=True) # sha256 of the post content
+    engine_version = db.Column(db.String(64), primary_key=True)
+    sentiment = db.Column(db.String(10), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, server_default = db.func.now())
+
+    def __repr__(self):
+        return f'<Score Cache: {self.content_hash[:12]} {self.score}>'
+
+
+# Running word counts per topic for the word cloud (see app.token_counts)
+# Each post is tokenized once when it is saved and its words are added here,
+# so the word cloud is built from these pre-aggregated counts instead of re-reading all the post text
+class TopicTokenCount(db.Model):
+    __tablename__ = 'topic_token_count'
+    topic = db.Column(db.String(255), primary_key=True)
+    token = db.Column(db.String(255), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    # For "top K words of a topic"
+    __table_args__ = (
+        db.Index('ix_topic_token_count_topic_count', 'topic', 'count'),
+    )
+
+    def __repr__(self):
+        return f'<Topic Token Count: {self.topic} {self.token}={self.count}>'
+
+
+# Time-bucketed sentiment rollups per topic (see app.rollups)
+# One row per topic per hour and per day with the counts and score aggregates of every post saved in that bucket
+# Kept up to date on every insert, so trend queries read a few hundred rollup rows instead of millions of raw rows
+class SentimentRollup(db.Model):
+    __tablename__ = 'sentiment_rollup'
+    topic = db.Column(db.String(255), primary_key=True)
+    granularity = db.Column(db.String(10), primary_key=True) # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    positive = db.Column(db.Integer, nullable=False, default=0)
+    negative = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    score_min = db.Column(db.Float, nullable=False)
+    score_max = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<Sentiment Rollup: {self.topic} {self.granularity} {self.bucket_start}>'
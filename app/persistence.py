@@ -0,0 +1,175 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import insert
+
+from app import db
+from app.models import Post, SentimentAnalysis, post_hash
+
+# Persistence layer for the post and sentiment_analysis tables
+# Writes go through one INSERT statement per chunk of rows (executemany) instead of one ORM object per row,
+# reads use the (topic, created_at) index defined on the model
+#
+# The text of a post is stored once in the post table (keyed by post_hash(title, content)),
+# sentiment_analysis only holds the topic, the score and the id of the post
+
+
+# Ids of the posts for a list of (hash, title, content), storing the ones that are not saved yet
+# Returns a dictionary hash -> post id
+def save_posts(posts, chunk_size=1000):
+    unique = {content_hash: (title, content) for content_hash, title, content in posts}
+    hashes = list(unique)
+    post_ids = {}
+    for start in range(0, len(hashes), chunk_size):
+        chunk = hashes[start:start + chunk_size]
+        # ON CONFLICT DO NOTHING - a post saved before (or by another worker just now) is left as it is
+        db.session.execute(
+            dialect_insert(Post).on_conflict_do_nothing(index_elements=['content_hash']),
+            [{"content_hash": content_hash, "title": unique[content_hash][0], "content": unique[content_hash][1]}
+             for content_hash in chunk]
+        )
+        # FOR KEY SHARE (PostgreSQL, ignored on SQLite) - compaction (app.retention) cannot delete these posts
+        # as orphans before the rows that refer to them are committed
+        post_ids.update(
+            db.session.query(Post.content_hash, Post.id)
+            .filter(Post.content_hash.in_(chunk))
+            .with_for_update(read=True, key_share=True)
+        )
+    return post_ids
+
+
+# The results whose post has no row under this topic yet (and every post only once)
+# A refetch of a topic (the cache warmer) mostly returns the posts it returned last time, saving those again would
+# count them twice in the rollups and the word counts. One query per chunk of posts.
+def unsaved_results(topic, results, chunk_size=1000):
+    hashes = [post_hash(result['title'], result['content']) for result in results]
+    unique = list(dict.fromkeys(hashes))
+    saved = set()
+    for start in range(0, len(unique), chunk_size):
+        saved.update(
+            content_hash for (content_hash,) in db.session.query(Post.content_hash)
+            .join(SentimentAnalysis, SentimentAnalysis.post_id == Post.id)
+            .filter(SentimentAnalysis.topic == topic, Post.content_hash.in_(unique[start:start + chunk_size]))
+            .distinct()
+        )
+    new = []
+    for content_hash, result in zip(hashes, results):
+        if content_hash not in saved:
+            saved.add(content_hash)
+            new.append(result)
+    return new
+
+
+# Save scored results for a topic with bulk INSERTs and commit once at the end
+# chunk_size - rows per INSERT statement (default: BULK_INSERT_CHUNK_SIZE from the app config)
+# The hourly/daily rollups (app.rollups) are updated in the same transaction, so they always match the rows
+def bulk_insert_results(topic, results, chunk_size=None):
+    from app.rollups import update_rollups
+
+    chunk_size = chunk_size or current_app.config.get('BULK_INSERT_CHUNK_SIZE', 1000)
+    results = list(results)
+    if not results:
+        return 0
+    # created_at is set here (UTC, like the database default) instead of by the server default,
+    # so the rows and the rollup buckets they are counted in use the same timestamp
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    hashes = [post_hash(result['title'], result['content']) for result in results]
+    post_ids = save_posts(
+        [(content_hash, result['title'], result['content']) for content_hash, result in zip(hashes, results)],
+        chunk_size
+    )
+    rows = [
+        {
+            "topic": topic,
+            "post_id": post_ids[content_hash],
+            "sentiment": result['sentiment'],
+            "score": result['score'],
+            "created_at": created_at,
+        }
+        for content_hash, result in zip(hashes, results)
+    ]
+
+    # Passing a list of dictionaries makes SQLAlchemy run the statement as executemany
+    statement = insert(SentimentAnalysis)
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(statement, rows[start:start + chunk_size])
+    update_rollups(topic, rows, created_at)
+    db.session.commit()
+    return len(rows)
+
+
+# INSERT statement with the ON CONFLICT support of the current database (SQLite and PostgreSQL both have it)
+# callers add .on_conflict_do_nothing() or .on_conflict_do_update(...) to it
+def dialect_insert(model):
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        return postgresql_insert(model)
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    return sqlite_insert(model)
+
+
+# Newest `limit` rows for a topic - answered from the (topic, created_at) index instead of a full table scan
+def latest_results(topic, limit):
+    return (
+        SentimentAnalysis.query
+        .filter_by(topic=topic)
+        .order_by(SentimentAnalysis.created_at.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+# Cursor based pagination for the JSON API
+# Rows are ordered newest first by id (ids grow with insert order) and the cursor is the id of the last row on the page,
+# so the next page is a plain range query on the (topic, id) index - no OFFSET that gets slower the further you page
+# (created_at is not used: SQLite stores the server default without microseconds, so equal timestamps
+#  would not compare equal to the value in the cursor and the page would never advance)
+def encode_cursor(record):
+    payload = json.dumps({"id": record.id})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+# Raises ValueError for a cursor that was not made by encode_cursor()
+def decode_cursor(cursor):
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))['id'])
+    except (TypeError, ValueError, KeyError, binascii.Error) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def _results_query(topic, cursor=None):
+    query = SentimentAnalysis.query.filter(SentimentAnalysis.topic == topic)
+    if cursor:
+        query = query.filter(SentimentAnalysis.id < decode_cursor(cursor))
+    return query.order_by(SentimentAnalysis.id.desc())
+
+
+# One page of rows, returns (records, next_cursor) - next_cursor is None on the last page
+def page_results(topic, limit, cursor=None):
+    records = _results_query(topic, cursor).limit(limit + 1).all()
+    if len(records) > limit:
+        return records[:limit], encode_cursor(records[limit - 1])
+    return records, None
+
+
+# Iterate over the rows without loading them all: yield_per() reads them from a server side cursor in chunks
+def iter_results(topic, limit=None, cursor=None, chunk_size=500):
+    query = _results_query(topic, cursor)
+    if limit is not None:
+        query = query.limit(limit)
+    yield from query.yield_per(chunk_size)
+
+
+# A stored row as a plain dictionary for the JSON / NDJSON responses
+def serialize_record(record):
+    return {
+        "id": record.id,
+        "topic": record.topic,
+        "title": record.title,
+        "content": record.content,
+        "sentiment": record.sentiment,
+        "score": record.score,
+        "created_at": record.created_at.isoformat() if record.created_at else None,
+    }
@@ -0,0 +1,53 @@
+from itertools import islice
+from flask import current_app
+
+from app.score_cache import score_posts
+from app.persistence import bulk_insert_results, unsaved_results
+from app.token_counts import record_tokens
+from app.metrics import stage, timed_iter
+
+# Streaming fetch -> score -> save pipeline
+# Instead of waiting for every Reddit post, then scoring all of them, then saving all of them,
+# posts are taken from the fetch generator in small micro-batches: each batch is scored and committed
+# before the next one is read, so the first results are ready early and only one batch is held in memory at a time
+
+
+# Split any iterable into lists of at most `size` items without reading ahead
+def iter_batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Generator version of the pipeline, yields the scored results one micro-batch at a time
+# posts - any iterable of posts, normally the fetch_reddit_data() generator
+# batch_size - posts per micro-batch (default: PIPELINE_BATCH_SIZE from the app config)
+def stream_pipeline(topic, posts, batch_size=None):
+    batch_size = batch_size or current_app.config.get('PIPELINE_BATCH_SIZE', 200)
+    # Every stage is timed for /metrics, 'fetch' is the time spent waiting for the posts generator
+    for batch in iter_batches(timed_iter(posts, 'fetch'), batch_size):
+        # score_posts() only scores posts it has not seen before, the rest come from the score cache
+        with stage('score'):
+            results = score_posts(batch)
+        # Posts already saved under this topic (a refetch) are not saved or counted again
+        with stage('db_write'):
+            new = unsaved_results(topic, results)
+            bulk_insert_results(topic, new)
+        # Count the words of the new posts once, the word cloud reads these running counts later
+        with stage('token_counts'):
+            record_tokens(topic, [result['content'] for result in new])
+        yield results
+
+
+# Run the whole pipeline and return every result as one list (what the HTML page needs)
+# on_batch - optional callback, called with the number of posts done so far after every micro-batch
+def run_pipeline(topic, posts, batch_size=None, on_batch=None):
+    sentiment_results = []
+    for results in stream_pipeline(topic, posts, batch_size):
+        sentiment_results.extend(results)
+        if on_batch is not None:
+            on_batch(len(sentiment_results))
+    return sentiment_results
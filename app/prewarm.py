@@ -0,0 +1,46 @@
+import logging
+import os
+import time
+
+from app import db
+
+# Opt-in warm up of everything that is loaded lazily
+# The app starts without NLTK, the VADER lexicon, matplotlib/seaborn/wordcloud or a database connection,
+# the first request that needs one of them pays for loading it. A production worker can pay that up front instead:
+#   PREWARM=1 in the environment - create_app() calls prewarm(app) before it returns
+#   or from a gunicorn hook in gunicorn.conf.py:
+#       def post_fork(server, worker):
+#           from app.prewarm import prewarm
+#           prewarm(worker.app.wsgi())
+
+logger = logging.getLogger(__name__)
+
+
+# Load the analyzer, the plotting libraries (drawing one tiny chart fills matplotlib's font cache),
+# the fast engine's vocabulary when it is the configured engine, and open the first database connection
+# Returns {step: seconds} so the cost of every step is visible
+def prewarm(app):
+    from app.analysis import get_analyzer
+    from app.graphs import render_graphs
+
+    timings = {}
+
+    def timed(name, function):
+        start = time.perf_counter()
+        function()
+        timings[name] = time.perf_counter() - start
+
+    timed('analyzer', get_analyzer)
+    if os.getenv('SENTIMENT_ENGINE', 'vader') == 'fast':
+        from app.fast_analysis import get_vocabulary
+        timed('fast_vocabulary', get_vocabulary)
+    timed('plotting', lambda: render_graphs([{"title": "", "content": "warm up", "sentiment": 'POSITIVE', "score": 0.5}], 'warm up'))
+
+    def connect():
+        with app.app_context():
+            with db.engine.connect():
+                pass
+    timed('database', connect)
+
+    logger.info('Prewarm done: %s', ', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items()))
+    return timings
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import praw
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+load_dotenv()
+
+# Long lived Reddit client shared by every fetch
+# fetch_reddit_data() used to build a new praw.Reddit (new HTTP session, new OAuth token, new TLS connections)
+# for every topic. Here one pooled requests.Session and one rate limiter live for the whole process.
+#
+# praw.Reddit objects are not safe to share between threads, so every thread gets its own praw.Reddit,
+# but all of them are built on the same pooled session and count against the same rate limiter.
+#
+# Settings (environment variables, like the other Reddit settings in .env):
+#   REDDIT_REQUESTS_PER_MINUTE - steady request rate of the token bucket (Reddit allows 100 per minute with OAuth)
+#   REDDIT_POOL_SIZE           - HTTP connections kept open in the pool
+#   REDDIT_FETCH_WORKERS       - topics fetched at the same time by fetch_many()
+#   REDDIT_OAUTH_URL / REDDIT_URL - API and token endpoints, only changed to point the client at a fake server in tests
+
+DEFAULT_REQUESTS_PER_MINUTE = 100
+DEFAULT_POOL_SIZE = 10
+DEFAULT_FETCH_WORKERS = 8
+
+
+# Token bucket that also follows Reddit's rate limit headers
+# The bucket refills at `rate` tokens per second up to `capacity`, every request takes one token.
+# After each response x-ratelimit-remaining / x-ratelimit-reset say how many requests are left in Reddit's
+# current window and when it resets - once the window is used up every request waits for the reset.
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.window_remaining = None # requests left in Reddit's window, None until a response said so
+        self.window_reset = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Block until a request may be sent
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.window_remaining is not None and now >= self.window_reset:
+                    self.window_remaining = None # Reddit's window has reset
+                if self.window_remaining is not None and self.window_remaining < 1:
+                    wait = self.window_reset - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    if self.window_remaining is not None:
+                        self.window_remaining -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # Read the rate limit headers of a response
+    def update_from_headers(self, headers):
+        try:
+            remaining = float(headers['x-ratelimit-remaining'])
+            reset = float(headers['x-ratelimit-reset'])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self.lock:
+            self.window_remaining = remaining
+            self.window_reset = time.monotonic() + reset
+
+
+# requests.Session with a bigger connection pool that waits for the rate limiter before every request
+class RateLimitedSession(requests.Session):
+    def __init__(self, limiter, pool_size=DEFAULT_POOL_SIZE):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.limiter = limiter
+
+    def request(self, *args, **kwargs):
+        self.limiter.acquire()
+        response = super().request(*args, **kwargs)
+        self.limiter.update_from_headers(response.headers)
+        return response
+
+
+_session = None
+_session_lock = threading.Lock()
+_generation = 0 # bumped by reset_client() so every thread builds a new praw.Reddit
+_local = threading.local()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            per_minute = float(os.getenv('REDDIT_REQUESTS_PER_MINUTE', DEFAULT_REQUESTS_PER_MINUTE))
+            # Allow a small burst (up to 10 requests) on top of the steady rate
+            limiter = TokenBucket(per_minute / 60.0, capacity=min(10.0, per_minute))
+            _session = RateLimitedSession(limiter, int(os.getenv('REDDIT_POOL_SIZE', DEFAULT_POOL_SIZE)))
+        return _session
+
+
+def _build_reddit(session):
+    settings = {}
+    if os.getenv('REDDIT_OAUTH_URL'):
+        settings['oauth_url'] = os.getenv('REDDIT_OAUTH_URL')
+    if os.getenv('REDDIT_URL'):
+        settings['reddit_url'] = os.getenv('REDDIT_URL')
+    return praw.Reddit(
+        client_id = os.getenv('REDDIT_CLIENT_ID'),
+        client_secret = os.getenv('REDDIT_CLIENT_SECRET'),
+        user_agent = os.getenv('REDDIT_USER_AGENT'),
+        requestor_kwargs = {'session': session},
+        check_for_updates = False,
+        **settings
+    )
+
+
+# This thread's praw.Reddit, built once on the shared session and reused for every later fetch
+def get_reddit():
+    session = get_session()
+    if getattr(_local, 'generation', None) != _generation:
+        _local.reddit = _build_reddit(session)
+        _local.generation = _generation
+    return _local.reddit
+
+
+# Forget the shared session and clients, the next fetch builds new ones (after changing the settings, and in tests)
+def reset_client():
+    global _session, _generation
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _generation += 1
+
+
+# Search r/all for a topic and yield every post as a dictionary, errors are raised to the caller
+def search_posts(topic, limit=10, reddit=None):
+    reddit = reddit or get_reddit()
+    reddit.read_only = True # We are only giving the read only permission
+    subreddit = reddit.subreddit('all') # all - with this we will consider all the subreddits in the account itself
+    for submission in subreddit.search(topic, sort='new', time_filter='all', limit=limit):
+        yield {
+            "title": submission.title,
+            "content": submission.selftext or 'No content Available',
+            "url": submission.url
+        }
+
+
+# Fetch many topics at the same time, at most max_workers at once (default REDDIT_FETCH_WORKERS)
+# Returns (results, errors): results maps topic -> list of posts, errors maps topic -> error message
+# reddit - optional client shared by every worker (for example app.fake_reddit.FakeReddit), otherwise each
+#          worker thread uses its own praw.Reddit on the shared session
+def fetch_many(topics, limit=10, max_workers=None, reddit=None):
+    topics = list(dict.fromkeys(topics))
+    results, errors = {}, {}
+    if not topics:
+        return results, errors
+    max_workers = max_workers or int(os.getenv('REDDIT_FETCH_WORKERS', DEFAULT_FETCH_WORKERS))
+
+    def fetch_one(topic):
+        return list(search_posts(topic, limit, reddit=reddit))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(topics)), thread_name_prefix='reddit-fetch') as pool:
+        futures = {topic: pool.submit(fetch_one, topic) for topic in topics}
+        for topic, future in futures.items():
+            try:
+                results[topic] = future.result()
+            except Exception as e:
+                errors[topic] = str(e)
+    return results, errors
@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app import cache
+from app.service import build_analysis
+from app.metrics import metrics
+
+# Result cache in front of build_analysis() for /analyze (replaces the old @cache.cached decorator)
+#
+# Normalized keys - "Python", " python " and "PYTHON" are one entry, and the limit is part of the key
+#                   whether it came from the form or the query string
+# Single-flight   - when an entry is missing only one request (in any worker process) builds it,
+#                   the lock is a cache.add() of a lock key: atomic SETNX on Redis, a local stand-in on SimpleCache
+#                   the other requests wait for the value instead of all hitting Reddit and the database together
+# Stale-while-revalidate - every entry stores its own fresh_until time and lives RESULT_CACHE_STALE_TTL seconds longer
+#                   in the cache, a stale entry is served at once while one request refreshes it in the background
+#
+# Config (see create_app):
+#   RESULT_CACHE_TTL          - seconds an entry is fresh
+#   RESULT_CACHE_STALE_TTL    - extra seconds a stale entry may still be served while it is refreshed
+#   RESULT_CACHE_LOCK_TIMEOUT - seconds a build lock is held at most (a crashed worker never blocks a key forever)
+#   RESULT_CACHE_WAIT         - seconds a request waits for another worker's build before building itself
+
+logger = logging.getLogger(__name__)
+
+_refresher = None
+_refresher_lock = threading.Lock()
+# SimpleCache.add() checks and sets in two steps, this makes it atomic between the threads of one process
+# (Redis SETNX already is atomic between processes)
+_add_lock = threading.Lock()
+
+
+# Lower case and single spaces, so the same topic typed differently shares one entry
+def normalize_topic(topic):
+    return ' '.join((topic or '').split()).casefold()
+
+
+def analysis_key(topic, limit, corpus=False):
+    prefix = 'analyze-corpus' if corpus else 'analyze'
+    return f"{prefix}:{normalize_topic(topic)}:{int(limit)}"
+
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+
+def _lock_key(key):
+    return f"{key}:lock"
+
+
+# Store a value as a fresh entry
+def store(key, value):
+    fresh = _config('RESULT_CACHE_TTL', 3600)
+    stale = _config('RESULT_CACHE_STALE_TTL', 3600)
+    cache.set(key, {"value": value, "fresh_until": time.time() + fresh}, timeout=fresh + stale)
+
+
+# Try to take the build lock of a key, returns a token when we got it, None when another request holds it
+def _acquire(key):
+    token = uuid.uuid4().hex
+    with _add_lock:
+        acquired = cache.add(_lock_key(key), token, timeout=_config('RESULT_CACHE_LOCK_TIMEOUT', 120))
+    if acquired:
+        return token
+    return None
+
+
+# Only the holder releases the lock (after a lock timeout somebody else may own it already)
+def _release(key, token):
+    if cache.get(_lock_key(key)) == token:
+        cache.delete(_lock_key(key))
+
+
+def _compute_and_store(key, compute, token):
+    try:
+        value = compute()
+        store(key, value)
+        return value
+    finally:
+        if token is not None:
+            _release(key, token)
+
+
+def _get_refresher():
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+        return _refresher
+
+
+# Rebuild a stale entry on a background thread, the request that noticed it does not wait
+def _refresh_in_background(key, compute, token):
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                _compute_and_store(key, compute, token)
+            except Exception:
+                logger.exception('Background refresh of %s failed', key)
+
+    return _get_refresher().submit(run)
+
+
+# Cached value of key, compute() builds it on a miss
+def get_or_compute(key, compute):
+    entry = cache.get(key)
+    if entry is not None:
+        # Stale - serve it anyway, the first request to notice starts the refresh
+        if time.time() >= entry['fresh_until']:
+            metrics.cache_requests.inc(result='stale')
+            token = _acquire(key)
+            if token is not None:
+                _refresh_in_background(key, compute, token)
+        else:
+            metrics.cache_requests.inc(result='hit')
+        return entry['value']
+
+    token = _acquire(key)
+    if token is not None:
+        metrics.cache_requests.inc(result='miss')
+        return _compute_and_store(key, compute, token)
+    metrics.cache_requests.inc(result='coalesced')
+
+    # Another request is building this entry - wait for its value
+    deadline = time.time() + _config('RESULT_CACHE_WAIT', 30)
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+        if cache.get(_lock_key(key)) is None:
+            break # the build failed or its lock timed out
+    return _compute_and_store(key, compute, _acquire(key))
+
+
+# Rebuild an entry ahead of time (the cache warmer), without making anybody wait for it
+# Skipped (returns False) while another request or worker holds the build lock, or when the entry is still
+# fresh for more than min_fresh seconds (another worker warmed it already)
+def refresh(key, compute, min_fresh=0):
+    entry = cache.get(key)
+    if entry is not None and entry['fresh_until'] - time.time() > min_fresh:
+        return False
+    token = _acquire(key)
+    if token is None:
+        return False
+    _compute_and_store(key, compute, token)
+    return True
+
+
+# Cached build_analysis() for the /analyze route
+# Only the cache key is normalized, the topic itself is passed on as it was typed: rows are saved and looked up
+# under that topic, like /results, /trend, /export and the job mode do
+def cached_analysis(topic, limit, corpus=False):
+    return get_or_compute(analysis_key(topic, limit, corpus), lambda: build_analysis(topic, limit, corpus=corpus))
+
+
+# Wait for background refreshes and stop the threads (used by tests and on shutdown)
+def shutdown_refresher(wait=True):
+    global _refresher
+    with _refresher_lock:
+        refresher, _refresher = _refresher, None
+    if refresher is not None:
+        refresher.shutdown(wait=wait)
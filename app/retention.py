@@ -0,0 +1,134 @@
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, exists
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import cache, db
+from app.models import Post, SentimentAnalysis
+from app.token_counts import remove_tokens
+
+# Retention policy and compaction for the stored results
+# sentiment_analysis grows with every fetch, most of it is never read again after a few weeks.
+# compact() deletes the rows older than RETENTION_DAYS and then the posts no row refers to any more.
+# Both run in small batches, every batch is its own short transaction with a pause in between,
+# so the tables are never locked for long and the app keeps writing while it runs.
+#
+# The hourly/daily rollups (app.rollups) are kept, /trend still covers the deleted period.
+# (rebuild-rollups after a compaction can only rebuild from the rows that are left)
+#
+# Config (see create_app):
+#   RETENTION_DAYS        - rows older than this many days are deleted (0 = keep everything, compaction off)
+#   COMPACTION_BATCH_SIZE - rows / posts deleted per transaction
+#   COMPACTION_INTERVAL   - seconds between two runs of the background compactor
+#   COMPACTION_PAUSE      - seconds of rest between two batches
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'compaction:lock'
+
+
+# Delete the rows older than retention_days and the posts that are left without rows
+# Returns {"rows": rows deleted, "posts": posts deleted}
+def compact(retention_days, batch_size=1000, pause=0.0):
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=retention_days)
+    removed_rows = 0
+    while True:
+        batch = (
+            db.session.query(SentimentAnalysis.id, SentimentAnalysis.topic, SentimentAnalysis.post_id)
+            .filter(SentimentAnalysis.created_at < cutoff)
+            .order_by(SentimentAnalysis.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        contents = dict(
+            db.session.query(Post.id, Post.content).filter(Post.id.in_({row.post_id for row in batch}))
+        )
+        db.session.execute(delete(SentimentAnalysis).where(SentimentAnalysis.id.in_([row.id for row in batch])))
+        db.session.commit()
+        # The word cloud counts (app.token_counts) lose the words of the deleted rows
+        by_topic = defaultdict(list)
+        for row in batch:
+            by_topic[row.topic].append(contents.get(row.post_id, ''))
+        for topic, texts in by_topic.items():
+            remove_tokens(topic, texts)
+        removed_rows += len(batch)
+        time.sleep(pause)
+
+    removed_posts = 0
+    unused = ~exists().where(SentimentAnalysis.post_id == Post.id)
+    while True:
+        orphans = [post_id for (post_id,) in db.session.query(Post.id).filter(unused).limit(batch_size)]
+        if not orphans:
+            break
+        # unused is checked again in the DELETE, a post saved again since the SELECT is kept
+        removed_posts += db.session.execute(delete(Post).where(Post.id.in_(orphans), unused)).rowcount
+        db.session.commit()
+        time.sleep(pause)
+    return {"rows": removed_rows, "posts": removed_posts}
+
+
+# Runs compact() every COMPACTION_INTERVAL seconds on a background thread
+# Set up like the other extensions: compactor = Compactor() here, compactor.init_app(app) in create_app()
+# With several worker processes every one of them has a compactor, a cache lock makes sure only one compacts per interval
+class Compactor:
+    def __init__(self):
+        self.retention_days = 0
+        self.batch_size = 1000
+        self.interval = 3600
+        self.pause = 0.1
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def init_app(self, app):
+        self.retention_days = app.config.get('RETENTION_DAYS', self.retention_days)
+        self.batch_size = app.config.get('COMPACTION_BATCH_SIZE', self.batch_size)
+        self.interval = app.config.get('COMPACTION_INTERVAL', self.interval)
+        self.pause = app.config.get('COMPACTION_PAUSE', self.pause)
+        app.extensions['compactor'] = self
+        if self.retention_days and not app.config.get('TESTING'):
+            self.start(app)
+
+    # One compaction, unless another process holds the lock. Returns the stats, or None when it did not run
+    def run_once(self):
+        if not cache.add(LOCK_KEY, True, timeout=self.interval):
+            return None
+        try:
+            stats = compact(self.retention_days, self.batch_size, self.pause)
+        except SQLAlchemyError:
+            # e.g. a post that got a new row while it was being deleted - the next run tries again
+            db.session.rollback()
+            logger.exception('Compaction failed')
+            return None
+        logger.info('Compaction removed %s rows and %s posts', stats["rows"], stats["posts"], extra=stats)
+        return stats
+
+    def _loop(self, app):
+        # A random first delay, so workers started together do not all try at the same moment
+        delay = random.uniform(0, min(self.interval, 60))
+        while not self.stopped.wait(delay):
+            with app.app_context():
+                self.run_once()
+            delay = self.interval
+
+    def start(self, app):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._loop, args=(app,), name='compactor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+compactor = Compactor()
@@ -0,0 +1,115 @@
+from sqlalchemy import case, delete
+
+from app import db
+from app.models import SentimentAnalysis, SentimentRollup
+
+# Hourly and daily sentiment rollups per topic
+# update_rollups() is called by app.persistence.bulk_insert_results() in the same transaction as the insert,
+# so the rollups always match the raw rows. rebuild_rollups() recomputes them from the raw rows
+# (after a manual data fix, or to fill them for rows saved before rollups existed - `flask rebuild-rollups`).
+
+GRANULARITIES = ['hour', 'day']
+
+
+# Start of the hour / day a timestamp falls in
+def bucket_start(timestamp, granularity):
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# Fold rows into {(topic, granularity, bucket_start): aggregate dict}
+# rows - iterable of (topic, sentiment, score, created_at)
+def aggregate(rows, buckets=None):
+    buckets = {} if buckets is None else buckets
+    for topic, sentiment, score, created_at in rows:
+        if created_at is None:
+            continue
+        for granularity in GRANULARITIES:
+            key = (topic, granularity, bucket_start(created_at, granularity))
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = {
+                    "count": 0, "positive": 0, "negative": 0,
+                    "score_sum": 0.0, "score_min": score, "score_max": score,
+                }
+            bucket["count"] += 1
+            bucket["positive" if sentiment == 'POSITIVE' else "negative"] += 1
+            bucket["score_sum"] += score
+            bucket["score_min"] = min(bucket["score_min"], score)
+            bucket["score_max"] = max(bucket["score_max"], score)
+    return buckets
+
+
+def _bucket_rows(buckets):
+    return [
+        {"topic": topic, "granularity": granularity, "bucket_start": start, **values}
+        for (topic, granularity, start), values in buckets.items()
+    ]
+
+
+# Add newly inserted results to their hour and day buckets (upsert, no commit - the caller commits with the insert)
+def update_rollups(topic, results, created_at):
+    buckets = aggregate((topic, result['sentiment'], result['score'], created_at) for result in results)
+    if not buckets:
+        return
+    from app.persistence import dialect_insert
+
+    statement = dialect_insert(SentimentRollup)
+    new = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=['topic', 'granularity', 'bucket_start'],
+        set_={
+            "count": SentimentRollup.count + new.count,
+            "positive": SentimentRollup.positive + new.positive,
+            "negative": SentimentRollup.negative + new.negative,
+            "score_sum": SentimentRollup.score_sum + new.score_sum,
+            "score_min": case((new.score_min < SentimentRollup.score_min, new.score_min), else_=SentimentRollup.score_min),
+            "score_max": case((new.score_max > SentimentRollup.score_max, new.score_max), else_=SentimentRollup.score_max),
+        }
+    )
+    db.session.execute(statement, _bucket_rows(buckets))
+
+
+# Recompute the rollups from the raw sentiment_analysis rows (for one topic, or all when topic is None)
+# Raw rows are streamed with yield_per, only the bucket aggregates are held in memory
+def rebuild_rollups(topic=None, chunk_size=5000):
+    query = db.session.query(
+        SentimentAnalysis.topic, SentimentAnalysis.sentiment, SentimentAnalysis.score, SentimentAnalysis.created_at
+    )
+    clear = delete(SentimentRollup)
+    if topic is not None:
+        query = query.filter(SentimentAnalysis.topic == topic)
+        clear = clear.where(SentimentRollup.topic == topic)
+
+    buckets = aggregate(query.yield_per(chunk_size))
+    db.session.execute(clear)
+    rows = _bucket_rows(buckets)
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(db.insert(SentimentRollup), rows[start:start + chunk_size])
+    db.session.commit()
+    return len(rows)
+
+
+# Trend of a topic from the rollups, oldest bucket first
+def trend(topic, granularity='day', since=None, until=None):
+    query = SentimentRollup.query.filter(
+        SentimentRollup.topic == topic,
+        SentimentRollup.granularity == granularity
+    )
+    if since is not None:
+        query = query.filter(SentimentRollup.bucket_start >= bucket_start(since, granularity))
+    if until is not None:
+        query = query.filter(SentimentRollup.bucket_start <= until)
+    return [
+        {
+            "bucket_start": rollup.bucket_start.isoformat(),
+            "count": rollup.count,
+            "positive": rollup.positive,
+            "negative": rollup.negative,
+            "average_score": rollup.score_sum / rollup.count if rollup.count else 0.0,
+            "min_score": rollup.score_min,
+            "max_score": rollup.score_max,
+        }
+        for rollup in query.order_by(SentimentRollup.bucket_start).all()
+    ]
@@ -2,17 +2,30 @@
                               #: request → to read user input (form / query data)
                               #: jsonify to send JSON responses
                               #: render_template → to show HTML pages
-from flask import Blueprint, request, jsonify, render_template
+import json
+from datetime import datetime, timezone
+from flask import Blueprint, request, jsonify, render_template, url_for, Response, stream_with_context
 
-# Function that fetches posts from Reddit based on a topic
-from app.fetch_reddit_data import fetch_reddit_data
-#Function that analyzes sentiment (positive / negative / neutral)
-from app.analysis import analyse_sentiment
-# from app.graphs import generate_graphs
-from app.graphs import generate_graphs
+# The work behind /analyze - load or fetch the results and render the charts
+from app.service import load_results
+# Result cache in front of the analysis - normalized keys, single-flight builds, stale-while-revalidate
+from app.result_cache import cached_analysis
+# Per-stage timings for /metrics
+from app.metrics import stage
+# Paginated / streamed reads of stored rows for the JSON API
+from app.persistence import page_results, iter_results, serialize_record, decode_cursor
+# Background job runner for the asynchronous mode of /analyze
+from app.jobs import jobs, QueueFullError
+# Counts the requested topics so the most popular ones are refreshed before their cache entries expire
+from app.warmer import warmer
+# Hourly / daily sentiment rollups for the trend endpoint
+from app.rollups import trend, GRANULARITIES
+# Full text search over the stored posts
+from app.search import search
+# Streaming CSV / gzip NDJSON dumps of the stored rows
+from app.export import export_results, FORMATS
 
 
-from app import db, cache # db → database connection (SQLAlchemy), cache → Redis cache object
 from app.models import SentimentAnalysis # Imports the database table model.
 from app.logger import configure_logger # Sets up logging so you can see: What is happening
 
@@ -21,7 +34,7 @@ from app.logger import configure_logger # Sets up logging so you can see: What i
 # Groups all sentiment-related routes
 # Uses templates from the templates folder, All sentiment logic lives here.
 sentiments_bp = Blueprint('sentiment', __name__, template_folder='templates')
-logger = configure_logger() # Creates a logger to print useful messages in terminal.
+logger = configure_logger() # Gets the app logger, the JSON log file is set up on the first call only
 
 # Now we will use the blueprint, When user visits /, Show the index.html page
 @sentiments_bp.route('/', methods=['GET', 'POST'])
@@ -30,77 +43,220 @@ def index():
 
 @sentiments_bp.route('/analyze', methods=['GET', 'POST'])
 # Main Sentiment Analysis Route
-# Since we are using redis cache so we will add cache annotator here -
-# Depending on the topic the cache will be hit or miss
-
-#Redis Cache Decorator
-# Store result in cache for 1 hour, Cache key is based on the topic, this is why because If user asks same topic again, don’t recompute everything.
-@cache.cached(
-    timeout=3600,
-    key_prefix=lambda: f"{request.form.get('topic') or request.args.get('topic', '')}_{request.form.get('num_records', 10)}"
-)
+# The results and charts are cached by app.result_cache for 1 hour under a normalized key (topic + number of records),
+# this is why because If user asks same topic again, don’t recompute everything.
+# Many requests for the same missing topic are coalesced into one build, and an expired entry is still served
+# while it is refreshed in the background
 def analyze_sentiment_route():
     # Reading User Input
     # Get topic from form or URL 
     topic = request.form.get('topic') or request.args.get('topic')
 
-    #Get number of records (default = 10)
-    limit = int(request.form.get('num_records', 10))
-
     # If user didn’t give topic → return error.
-    if not topic:
+    if not topic or not topic.strip():
         return jsonify({'error': 'Topic is required'}), 400
+
+    #Get number of records (default = 10), from the form or the URL
+    try:
+        limit = int(request.form.get('num_records') or request.args.get('num_records') or 10)
+    except ValueError:
+        return jsonify({'error': 'num_records must be a number'}), 400
+    if limit < 1:
+        return jsonify({'error': 'num_records must be a positive number'}), 400
     
-    # Go to the sentiment_analysis table, find records for this topic, sort them by newest first, take only a few of them, and give me all those records
-    sentiment_results = SentimentAnalysis.query.filter_by(topic=topic).order_by(SentimentAnalysis.created_at.desc()).limit(limit).all()
-    
-    # If data exists in DB
-    # Data already exists → no need to call Reddit again
-    # Log that DB was used
-    # Convert DB objects into simple list of dictionary format
-    if sentiment_results:
+    # source=corpus - analyse the stored posts (under any topic) that match the topic as a search query, no Reddit fetch
+    corpus = (request.form.get('source') or request.args.get('source')) == 'corpus'
+    if not corpus:
+        warmer.record(topic, limit)
+
+    # Load the results from the cache, or from the database (or fetch, score and save them) and draw the bar chart and the word cloud
+    analysis = cached_analysis(topic, limit, corpus=corpus)
+    if analysis['source'] == 'database':
         logger.info('Data fetched from sentiment analysis table')
-        sentiment_results = [
-            {
-                "title" : record.title,
-                "content" : record.content,
-                "sentiment": record.sentiment,
-                "score": record.score,
-            }
-            for record in sentiment_results
-        ]
-    else:  # If data NOT in DB, Fetch Reddit data, Analyze sentiment, Save results to database
-        posts = fetch_reddit_data(topic, limit) # Fetch Reddit posts for a given topic
-        # Analyze sentiment -
-        sentiment_results = analyse_sentiment(posts)
-
-        # Save each result to database
-        # db.session.add(...) - Add this new record to the temporary session, Still NOT saved in database, SQLAlchemy uses a session as a waiting area
-        # For every sentiment result: Create a record and add it to the session, at this point the data is in memory not yet saved in database
-        # db.session.commit() - Finally save everything permanently, Write data into the database table, which indicates Confirm and save all changes
-        for result in sentiment_results:
-            db.session.add(SentimentAnalysis(
-                topic=topic,
-                title=result['title'],
-                content=result['content'],
-                sentiment=result['sentiment'],
-                score = result['score'],
-            ))
-        db.session.commit()
-
-    # generate_graphs() creates: a bar chart, a word cloud, These images are converted into base64 strings
-    # Not saved to disk, Not saved to Database, it is in memory
-    bar_chart_64, word_cloud_b64 = generate_graphs(sentiment_results, topic)
+    if corpus and not analysis['sentiment_results']:
+        return jsonify({'error': 'No stored posts match this topic'}), 404
 
     # Take all this data that is currently in memory and give it to index.html
     # Takes index.html, and injects topic, sentiment_results, bar_chart_64 and word_cloud_b64 all variables into it.
-    return render_template(
-        'index.html',
-        topic=topic,
-        sentiment_results=sentiment_results,
-        bar_chart_64=bar_chart_64,
-        word_cloud_b64=word_cloud_b64 
-    )
+    with stage('template'):
+        return render_template(
+            'index.html',
+            topic=topic,
+            sentiment_results=analysis['sentiment_results'],
+            bar_chart_64=analysis['bar_chart_64'],
+            word_cloud_b64=analysis['word_cloud_b64']
+        )
 
 # This is how the render template will take all of this all together and publish in Jinja template as dynamic variable
-# and publish it as UI.
\ No newline at end of file
+# and publish it as UI.
+
+
+# Asynchronous mode of /analyze
+# POST queues the analysis and answers right away with a job id (202 Accepted), the work runs on a background thread
+# If the same topic + num_records is already queued or running, the existing job is returned instead of a new one
+@sentiments_bp.route('/analyze/jobs', methods=['POST'])
+def submit_analyze_job():
+    data = request.get_json(silent=True) or {}
+    topic = data.get('topic') or request.form.get('topic') or request.args.get('topic')
+    if not topic:
+        return jsonify({'error': 'Topic is required'}), 400
+
+    try:
+        limit = int(data.get('num_records') or request.form.get('num_records') or request.args.get('num_records') or 10)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'num_records must be a number'}), 400
+    if limit < 1:
+        return jsonify({'error': 'num_records must be a positive number'}), 400
+
+    try:
+        job, created = jobs.submit(topic, limit)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503
+
+    response = job.to_dict()
+    response['created'] = created
+    response['status_url'] = url_for('sentiment.analyze_job_status', job_id=job.id)
+    return jsonify(response), 202
+
+# Status of a job: stage and progress while it runs, the full result (results + base64 charts) once it is done
+@sentiments_bp.route('/analyze/jobs/<job_id>', methods=['GET'])
+def analyze_job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+RESULTS_PAGE_SIZE = 50 # default page size of /results
+RESULTS_MAX_PAGE_SIZE = 1000
+
+# Machine facing results API - scores only, no charts and no HTML
+# GET /results?topic=python&limit=50                     -> one JSON page plus next_cursor
+# GET /results?topic=python&limit=50&cursor=<next_cursor> -> the following page
+# GET /results?topic=python&format=ndjson                 -> every stored row, streamed one JSON object per line
+# GET /results?topic=python&fetch=1                      -> if nothing is stored for the topic yet, fetch, score and save
+#                                                           one page worth of posts first (opt-in, a plain GET never writes)
+@sentiments_bp.route('/results', methods=['GET'])
+def results_api():
+    topic = request.args.get('topic')
+    if not topic:
+        return jsonify({'error': 'Topic is required'}), 400
+
+    cursor = request.args.get('cursor')
+    output_format = request.args.get('format', 'json')
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({'error': 'limit must be a positive number'}), 400
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    page_size = min(limit or RESULTS_PAGE_SIZE, RESULTS_MAX_PAGE_SIZE)
+
+    # Explicit fetch=1 for an unknown topic - run the fetch/score/save pipeline (no rendering) for one page of posts
+    if not cursor and request.args.get('fetch') == '1' and SentimentAnalysis.query.filter_by(topic=topic).first() is None:
+        load_results(topic, page_size)
+
+    if output_format == 'ndjson':
+        # Rows are read in chunks from a server side cursor and written out as they come, memory stays flat for any limit
+        def generate():
+            for record in iter_results(topic, limit=limit, cursor=cursor):
+                yield json.dumps(serialize_record(record)) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    if output_format != 'json':
+        return jsonify({'error': 'format must be json or ndjson'}), 400
+
+    records, next_cursor = page_results(topic, page_size, cursor)
+    return jsonify({
+        'topic': topic,
+        'results': [serialize_record(record) for record in records],
+        'next_cursor': next_cursor,
+    })
+
+
+
+# ISO date from the query string as a naive UTC datetime (how the timestamps are stored), None when missing
+def _parse_time(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+# Sentiment trend of a topic over time, read from the hourly/daily rollups (app.rollups) instead of the raw rows
+# GET /trend?topic=python&bucket=day&since=2026-01-01&until=2026-02-01T12:00:00
+# since / until are optional ISO dates (UTC), every bucket has count, positive, negative, average/min/max score
+@sentiments_bp.route('/trend', methods=['GET'])
+def trend_api():
+    topic = request.args.get('topic')
+    if not topic:
+        return jsonify({'error': 'Topic is required'}), 400
+
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in GRANULARITIES:
+        return jsonify({'error': 'bucket must be hour or day'}), 400
+
+    try:
+        since = _parse_time('since')
+        until = _parse_time('until')
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO dates'}), 400
+
+    return jsonify({
+        'topic': topic,
+        'bucket': bucket,
+        'trend': trend(topic, bucket, since, until),
+    })
+
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 200
+
+# Full text search over every stored post, whatever topic it was saved under, best match first
+# GET /search?q=machine+learning&limit=20   (optional &topic=... to search inside one topic only)
+@sentiments_bp.route('/search', methods=['GET'])
+def search_api():
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({'error': 'q is required'}), 400
+    limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+    if limit < 1:
+        return jsonify({'error': 'limit must be a positive number'}), 400
+
+    results = search(query, min(limit, SEARCH_MAX_PAGE_SIZE), topic=request.args.get('topic'))
+    return jsonify({'query': query, 'results': results})
+
+
+# Download every stored row of a topic, optionally only a date range, as CSV or gzip compressed NDJSON
+# GET /export?topic=python&since=2026-01-01&until=2026-02-01&format=csv      -> python.csv
+# GET /export?topic=python&format=ndjson                                    -> python.ndjson.gz
+# The rows are streamed from a server side cursor while the response is sent, memory stays flat for any size
+@sentiments_bp.route('/export', methods=['GET'])
+def export_api():
+    topic = request.args.get('topic')
+    if not topic:
+        return jsonify({'error': 'Topic is required'}), 400
+    output_format = request.args.get('format', 'csv')
+    if output_format not in FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    try:
+        since = _parse_time('since')
+        until = _parse_time('until')
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO dates'}), 400
+
+    filename = ''.join(char if char.isalnum() else '_' for char in topic)
+    if output_format == 'csv':
+        mimetype, filename = 'text/csv', f'{filename}.csv'
+    else:
+        mimetype, filename = 'application/gzip', f'{filename}.ndjson.gz'
+    response = Response(
+        stream_with_context(export_results(output_format, topic, since, until)), mimetype=mimetype
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
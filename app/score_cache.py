@@ -0,0 +1,204 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import has_app_context
+from sqlalchemy import delete
+
+from app import db
+from app.models import ScoreCache
+from app.analysis import analyse_sentiment_batch
+from app.persistence import dialect_insert
+
+# Memoization of per-post sentiment scores, keyed by a hash of the post content
+# Two tiers:
+#   1. a bounded in-process LRU (fast, lost on restart)
+#   2. the score_cache table (shared by every worker, survives restarts)
+# The same Reddit post keeps coming back across topics and refreshes, with this it is only scored once
+#
+# Invalidation: every entry is stored together with the engine version. The version is built from the engine name,
+# SCORER_REVISION and a hash of the lexicon, so editing the lexicon file or bumping SCORER_REVISION after
+# changing the scoring code makes every old entry a miss. purge_stale_scores() removes those old rows.
+
+# Bump this when the scoring logic changes in a way that changes scores
+SCORER_REVISION = 1
+
+# Every engine analyse_sentiment_batch() can run, a deployment may use several at once (e.g. 'fast' for backfills)
+KNOWN_ENGINES = ['vader', 'fast']
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+# sha256 of the post content, used as the cache key
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+# Version string for the given engine, worked out once per engine from the lexicon it actually uses
+def engine_version(engine=None):
+    engine = engine or os.getenv('SENTIMENT_ENGINE', 'vader')
+    if engine not in _versions:
+        with _versions_lock:
+            if engine not in _versions:
+                if engine == 'fast':
+                    from app.fast_analysis import LEXICON_PATH
+                    with open(LEXICON_PATH, 'rb') as lexicon_file:
+                        lexicon_digest = hashlib.sha256(lexicon_file.read()).hexdigest()
+                else:
+                    from app.analysis import get_analyzer
+                    lexicon_digest = hashlib.sha256(get_analyzer().lexicon_file.encode('utf-8')).hexdigest()
+                from app.analysis import load_nltk
+                _versions[engine] = f'{engine}-nltk{load_nltk().__version__}-r{SCORER_REVISION}-{lexicon_digest[:16]}'
+    return _versions[engine]
+
+
+# The in-process LRU tier plus hit/miss counters
+# memory_hits - found in the LRU, db_hits - found in the score_cache table, misses - had to be scored
+class ScoreMemo:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def record(self, memory_hits=0, db_hits=0, misses=0):
+        with self.lock:
+            self.memory_hits += memory_hits
+            self.db_hits += db_hits
+            self.misses += misses
+
+    def stats(self):
+        with self.lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.memory_hits = self.db_hits = self.misses = 0
+
+
+# SCORE_CACHE_SIZE - how many scores the in-process LRU keeps
+score_memo = ScoreMemo(int(os.getenv('SCORE_CACHE_SIZE', 10000)))
+
+
+# Look up stored scores for many hashes at once, returns {hash: (sentiment, score)}
+def _load_scores(hashes, version, chunk_size=500):
+    found = {}
+    hashes = list(hashes)
+    for start in range(0, len(hashes), chunk_size):
+        rows = db.session.query(ScoreCache.content_hash, ScoreCache.sentiment, ScoreCache.score).filter(
+            ScoreCache.engine_version == version,
+            ScoreCache.content_hash.in_(hashes[start:start + chunk_size])
+        ).all()
+        for row in rows:
+            found[row.content_hash] = (row.sentiment, row.score)
+    return found
+
+
+# Store new scores, rows another worker stored at the same time are skipped instead of failing
+def _store_scores(scores, version):
+    if not scores:
+        return
+    rows = [
+        {"content_hash": key, "engine_version": version, "sentiment": sentiment, "score": score}
+        for key, (sentiment, score) in scores.items()
+    ]
+    db.session.execute(dialect_insert(ScoreCache).on_conflict_do_nothing(), rows)
+    db.session.commit()
+
+
+# Cached version of analyse_sentiment_batch(), same input and the same list of dictionaries back
+# Only posts whose content has never been scored by the current engine version are actually scored
+def score_posts(posts, engine=None):
+    posts = list(posts)
+    version = engine_version(engine)
+    keys = [content_hash(post['content']) for post in posts]
+    use_db = has_app_context()
+
+    scores = {}
+    for key in keys:
+        value = score_memo.get((version, key))
+        if value is not None:
+            scores[key] = value
+    memory_hits = len(scores)
+
+    missing = {key for key in keys if key not in scores}
+    db_scores = _load_scores(missing, version) if use_db and missing else {}
+    for key, value in db_scores.items():
+        scores[key] = value
+        score_memo.put((version, key), value)
+
+    # Score each distinct missing content once, even if it shows up several times in this batch
+    to_score = {}
+    for key, post in zip(keys, posts):
+        if key not in scores and key not in to_score:
+            to_score[key] = post
+    new_scores = {}
+    if to_score:
+        for key, result in zip(to_score, analyse_sentiment_batch(to_score.values(), engine=engine)):
+            new_scores[key] = (result['sentiment'], result['score'])
+            score_memo.put((version, key), new_scores[key])
+        scores.update(new_scores)
+        if use_db:
+            _store_scores(new_scores, version)
+
+    score_memo.record(memory_hits=memory_hits, db_hits=len(db_scores), misses=len(to_score))
+
+    results = []
+    for key, post in zip(keys, posts):
+        sentiment, score = scores[key]
+        results.append({
+            "title": post['title'],
+            "content": post['content'],
+            "sentiment": sentiment,
+            "score": score
+        })
+    return results
+
+
+# Delete stored scores that no current engine version can use (old lexicon or old scoring code)
+# Rows of every engine in KNOWN_ENGINES at its current version are kept, so purging never wipes
+# the valid cache of another engine that the same deployment also uses
+# Runs in batches so it never holds a long lock on the table
+def purge_stale_scores(batch_size=5000):
+    current = [engine_version(engine) for engine in KNOWN_ENGINES]
+    removed = 0
+    while True:
+        stale = [row.content_hash for row in db.session.query(ScoreCache.content_hash).filter(
+            ScoreCache.engine_version.notin_(current)
+        ).limit(batch_size).all()]
+        if not stale:
+            break
+        db.session.execute(delete(ScoreCache).where(
+            ScoreCache.engine_version.notin_(current),
+            ScoreCache.content_hash.in_(stale)
+        ))
+        db.session.commit()
+        removed += len(stale)
+    return removed
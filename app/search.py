@@ -0,0 +1,136 @@
+from sqlalchemy import DDL, event, text
+
+from app import db
+from app.models import Post
+
+# Full text search over the title and content of every stored post, whatever topic it was saved under
+# The text lives in the post table (one row per distinct post), so that is the table that is indexed
+#
+# SQLite     - an FTS5 table (post_fts) that indexes post as "external content":
+#              the text is not stored twice, triggers keep the index in step with every INSERT / UPDATE / DELETE
+#              ranking: bm25()
+# PostgreSQL - a generated tsvector column (search_vector) with a GIN index, PostgreSQL keeps it up to date itself
+#              ranking: ts_rank()
+#
+# New tables get the index from the after_create hooks below (db.create_all()), existing databases from
+# install_search_index() in app.migrations.upgrade_database(), which also indexes the rows that are already there.
+
+FTS_TABLE = 'post_fts'
+
+SQLITE_STATEMENTS = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "title, content, content='post', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE ON post BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+]
+
+POSTGRES_COLUMN = (
+    "ALTER TABLE post ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', coalesce(title, '') || ' ' || coalesce(content, ''))) STORED"
+)
+POSTGRES_INDEX = 'CREATE INDEX {concurrently}IF NOT EXISTS ix_post_search ON post USING gin (search_vector)'
+
+
+# Hooks on the table itself, so create_all() / drop_all() also create / drop the index (tests and new installs)
+for statement in SQLITE_STATEMENTS:
+    event.listen(Post.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Post.__table__, 'after_drop', DDL(f'DROP TABLE IF EXISTS {FTS_TABLE}').execute_if(dialect='sqlite'))
+event.listen(Post.__table__, 'after_create', DDL(POSTGRES_COLUMN).execute_if(dialect='postgresql'))
+event.listen(
+    Post.__table__, 'after_create',
+    DDL(POSTGRES_INDEX.format(concurrently='')).execute_if(dialect='postgresql')
+)
+
+
+# Add the index to a database whose post table already exists and index the rows it has
+# connection - an AUTOCOMMIT connection (CREATE INDEX CONCURRENTLY cannot run in a transaction)
+# On PostgreSQL adding the generated column rewrites the table once, run the upgrade in a quiet moment
+def install_search_index(connection):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+        ).first()
+        for statement in SQLITE_STATEMENTS:
+            connection.execute(text(statement))
+        if not exists:
+            # Index every row that was stored before the search table existed
+            connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        connection.execute(text(POSTGRES_COLUMN))
+        connection.execute(text(POSTGRES_INDEX.format(concurrently='CONCURRENTLY ')))
+
+
+# Turn what the user typed into an FTS5 query: every word must appear, FTS5 operators and quotes are taken literally
+def _fts5_query(query):
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+# Any other database has no full text index: every word must appear in the title or the content (LIKE),
+# matches are not ranked (rank 0, newest posts first)
+def _like_matches(query, params):
+    conditions = []
+    for index, word in enumerate(query.lower().split()):
+        escaped = word.replace('!', '!!').replace('%', '!%').replace('_', '!_') # % and _ are taken literally
+        params[f"word{index}"] = f'%{escaped}%'
+        conditions.append(
+            f"(lower(p.title) LIKE :word{index} ESCAPE '!' OR lower(p.content) LIKE :word{index} ESCAPE '!')"
+        )
+    return "SELECT p.id, p.title, p.content, 0.0 AS rank FROM post p WHERE " + ' AND '.join(conditions)
+
+
+# Best matching stored posts for a search query, best first
+# Every post is returned once, with its newest score (for `topic`: its newest score under that topic)
+# Returns dictionaries like the /results API plus "rank" (higher is a better match)
+def search(query, limit=20, topic=None):
+    if not query or not query.split():
+        return []
+    dialect = db.engine.dialect.name
+    params = {"query": query, "limit": limit, "topic": topic}
+    if dialect == 'sqlite':
+        params["query"] = _fts5_query(query)
+        matches = (
+            f"SELECT p.id, p.title, p.content, -bm25({FTS_TABLE}) AS rank "
+            f"FROM {FTS_TABLE} JOIN post p ON p.id = {FTS_TABLE}.rowid WHERE {FTS_TABLE} MATCH :query"
+        )
+    elif dialect == 'postgresql':
+        matches = (
+            "SELECT p.id, p.title, p.content, ts_rank(p.search_vector, websearch_to_tsquery('english', :query)) AS rank "
+            "FROM post p WHERE p.search_vector @@ websearch_to_tsquery('english', :query)"
+        )
+    else:
+        matches = _like_matches(query, params)
+
+    # Only posts with a score row (under the topic) count, and only the best `limit` of them are joined
+    # with their newest score row below - a common word does not join every post it appears in
+    topic_condition = 'AND s2.topic = :topic' if topic else ''
+    matches += (
+        f" AND EXISTS (SELECT 1 FROM sentiment_analysis s2 WHERE s2.post_id = p.id {topic_condition}) "
+        "ORDER BY rank DESC, p.id DESC LIMIT :limit"
+    )
+    sql = (
+        "SELECT s.id, s.topic, m.title, m.content, s.sentiment, s.score, s.created_at, m.rank "
+        f"FROM ({matches}) m JOIN sentiment_analysis s ON s.id = ("
+        f"SELECT max(s2.id) FROM sentiment_analysis s2 WHERE s2.post_id = m.id {topic_condition}) "
+        "ORDER BY m.rank DESC, m.id DESC"
+    )
+
+    results = []
+    for row in db.session.execute(text(sql), params).mappings():
+        created_at = row['created_at']
+        results.append({
+            "id": row['id'],
+            "topic": row['topic'],
+            "title": row['title'],
+            "content": row['content'],
+            "sentiment": row['sentiment'],
+            "score": row['score'],
+            "created_at": created_at.isoformat() if hasattr(created_at, 'isoformat') else created_at,
+            "rank": float(row['rank']),
+        })
+    return results
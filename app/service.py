@@ -0,0 +1,119 @@
+# Module with the fetch_reddit_data() generator that fetches posts from Reddit based on a topic
+# (we keep the module and look the function up on every call so tests can swap it out)
+from app import fetch_reddit_data as reddit_source
+# Streaming pipeline - scores the posts (see app.analysis and app.score_cache) and saves them in micro-batches as they arrive
+from app.pipeline import run_pipeline
+from app.graphs import generate_graphs
+from app.persistence import latest_results # Indexed read of the newest rows for a topic
+from app.token_counts import top_tokens # Pre-aggregated word counts per topic for the word cloud
+from app.metrics import stage # Per-stage timings for /metrics
+from app.search import search # Full text search over every stored post, for the local corpus mode
+
+# The work behind /analyze, kept out of the route so the HTML route, the background job runner
+# and anything else that needs an analysis all go through the same code
+#
+# progress - optional callback progress(stage, fraction) used by background jobs to report where they are
+#            stage is 'fetching', 'scoring', 'rendering' or 'done', fraction goes from 0.0 to 1.0
+
+
+def _report(progress, stage, fraction):
+    if progress is not None:
+        progress(stage, fraction)
+
+
+# Get the sentiment results for a topic, returns (sentiment_results, source)
+# source is 'database' when stored rows were reused, 'reddit' when the posts had to be fetched and scored
+def load_results(topic, limit, progress=None):
+    _report(progress, 'fetching', 0.0)
+
+    # Go to the sentiment_analysis table, find records for this topic, sort them by newest first, take only a few of them, and give me all those records
+    with stage('db_query'):
+        records = latest_results(topic, limit)
+
+    # If data exists in DB
+    # Data already exists → no need to call Reddit again
+    # Convert DB objects into simple list of dictionary format
+    if records:
+        sentiment_results = [
+            {
+                "title" : record.title,
+                "content" : record.content,
+                "sentiment": record.sentiment,
+                "score": record.score,
+            }
+            for record in records
+        ]
+        return sentiment_results, 'database'
+
+    # If data NOT in DB, Fetch Reddit data, Analyze sentiment, Save results to database
+    # Fetch Reddit posts for a given topic - this is a generator, nothing is downloaded yet
+    posts = reddit_source.fetch_reddit_data(topic, limit)
+
+    # Analyze sentiment and save to database -
+    # run_pipeline() reads the posts in micro-batches, scores each batch and commits it before reading the next one
+    # so scoring and saving overlap with the Reddit fetch instead of waiting for all of it
+    def on_batch(done):
+        _report(progress, 'scoring', min(done / max(limit, 1), 1.0))
+
+    sentiment_results = run_pipeline(topic, posts, on_batch=on_batch)
+    return sentiment_results, 'reddit'
+
+
+# Fetch and score the newest posts of a topic even when rows are already stored (used by the cache warmer,
+# so a hot topic picks up new posts), only posts not saved under the topic yet are stored.
+# Returns the number of posts fetched
+def refresh_results(topic, limit):
+    posts = reddit_source.fetch_reddit_data(topic, limit)
+    return len(run_pipeline(topic, posts))
+
+
+# Local corpus mode - the best matching posts already stored under any topic, found with the full text index
+# Nothing is fetched from Reddit and nothing new is saved, returns (sentiment_results, 'corpus')
+def load_corpus_results(query, limit, progress=None):
+    _report(progress, 'fetching', 0.0)
+    with stage('search'):
+        matches = search(query, limit)
+    sentiment_results = [
+        {
+            "title": match['title'],
+            "content": match['content'],
+            "sentiment": match['sentiment'],
+            "score": match['score'],
+        }
+        for match in matches
+    ]
+    return sentiment_results, 'corpus'
+
+
+# Full analysis - results plus the two charts, everything index.html needs
+# corpus - answer from the stored posts that match the topic as a search query (load_corpus_results) instead of
+#          the rows saved for exactly this topic / a Reddit fetch
+def build_analysis(topic, limit, progress=None, corpus=False):
+    if corpus:
+        sentiment_results, source = load_corpus_results(topic, limit, progress)
+    else:
+        sentiment_results, source = load_results(topic, limit, progress)
+
+    # generate_graphs() creates: a bar chart, a word cloud, These images are converted into base64 strings
+    # Not saved to disk, Not saved to Database, it is in memory
+    # The word cloud uses the topic's running word counts (top 200 words), no need to re-read all the text
+    # (search results come from many topics, their words are counted from the matching posts instead)
+    _report(progress, 'rendering', 1.0)
+    word_counts = None
+    if not corpus:
+        with stage('db_query'):
+            word_counts = top_tokens(topic)
+    bar_chart_64, word_cloud_b64 = '', ''
+    # A search with no matches has nothing to draw (the word cloud needs at least one word)
+    if sentiment_results:
+        with stage('render_graphs'):
+            bar_chart_64, word_cloud_b64 = generate_graphs(sentiment_results, topic, word_counts=word_counts)
+
+    _report(progress, 'done', 1.0)
+    return {
+        "topic": topic,
+        "source": source,
+        "sentiment_results": sentiment_results,
+        "bar_chart_64": bar_chart_64,
+        "word_cloud_b64": word_cloud_b64,
+    }
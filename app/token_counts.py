@@ -0,0 +1,107 @@
+import re
+from collections import Counter
+
+from sqlalchemy import bindparam, delete, update
+
+from app import db
+from app.models import Post, SentimentAnalysis, TopicTokenCount
+from app.persistence import dialect_insert
+
+# Incremental per-topic word counts for the word cloud
+# Before: every request joined the text of all results, ran a regex over it and built a new Counter (cost grows with the text)
+# Now: each post is tokenized once when it is saved and its counts are added to topic_token_count,
+# the word cloud only reads the top K words of the topic (cost grows with the vocabulary, not the text)
+# When posts are purged their counts are subtracted again with remove_tokens()
+# Rows saved before the counts existed are counted with rebuild_token_counts() (flask rebuild-token-counts)
+
+# Longer "words" are almost always URLs or junk, they would not fit the token column anyway
+MAX_TOKEN_LENGTH = 255
+
+
+# Same cleaning the word cloud always used: lowercase, drop everything that is not a letter or whitespace, split
+def tokenize(content):
+    return re.sub(r'[^A-Za-z\s]', '', content.lower()).split()
+
+
+# Word counts for a list of post contents
+def count_tokens(contents):
+    counts = Counter()
+    for content in contents:
+        counts.update(token for token in tokenize(content) if len(token) <= MAX_TOKEN_LENGTH)
+    return counts
+
+
+# Add the words of newly saved posts to the topic's running counts (one upsert per chunk of words)
+def record_tokens(topic, contents, chunk_size=1000):
+    counts = count_tokens(contents)
+    if not counts:
+        return 0
+    rows = [{"topic": topic, "token": token, "count": count} for token, count in counts.items()]
+    statement = dialect_insert(TopicTokenCount)
+    statement = statement.on_conflict_do_update(
+        index_elements=['topic', 'token'],
+        set_={"count": TopicTokenCount.count + statement.excluded.count}
+    )
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(statement, rows[start:start + chunk_size])
+    db.session.commit()
+    return len(rows)
+
+
+# Subtract the words of purged posts, words that drop to zero are deleted
+# One UPDATE statement per chunk of words (executemany), like record_tokens()
+def remove_tokens(topic, contents, chunk_size=1000):
+    counts = count_tokens(contents)
+    if not counts:
+        return 0
+    table = TopicTokenCount.__table__
+    statement = (
+        update(table)
+        .where(table.c.topic == bindparam('b_topic'), table.c.token == bindparam('b_token'))
+        .values(count=table.c.count - bindparam('b_count'))
+    )
+    rows = [{"b_topic": topic, "b_token": token, "b_count": count} for token, count in counts.items()]
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(statement, rows[start:start + chunk_size])
+    db.session.execute(
+        delete(TopicTokenCount).where(TopicTokenCount.topic == topic, TopicTokenCount.count <= 0)
+    )
+    db.session.commit()
+    return len(counts)
+
+
+# Count the words again from the stored rows (one topic, or every topic when topic is None)
+# For rows saved before topic_token_count existed, or after the counts got out of step.
+# Rows are streamed with yield_per and counted one topic at a time, every topic is committed on its own.
+# Returns the number of topics rebuilt
+def rebuild_token_counts(topic=None, chunk_size=5000):
+    if topic is None:
+        topics = [row.topic for row in db.session.query(SentimentAnalysis.topic).distinct()]
+    else:
+        topics = [topic]
+    for name in topics:
+        contents = (
+            db.session.query(Post.content)
+            .join(SentimentAnalysis, SentimentAnalysis.post_id == Post.id)
+            .filter(SentimentAnalysis.topic == name)
+            .yield_per(chunk_size)
+        )
+        counts = count_tokens(content for (content,) in contents)
+        db.session.execute(delete(TopicTokenCount).where(TopicTokenCount.topic == name))
+        rows = [{"topic": name, "token": token, "count": count} for token, count in counts.items()]
+        for start in range(0, len(rows), chunk_size):
+            db.session.execute(TopicTokenCount.__table__.insert(), rows[start:start + chunk_size])
+        db.session.commit()
+    return len(topics)
+
+
+# The K most frequent words of a topic as {word: count}, ready for WordCloud.generate_from_frequencies()
+def top_tokens(topic, k=200):
+    rows = (
+        db.session.query(TopicTokenCount.token, TopicTokenCount.count)
+        .filter(TopicTokenCount.topic == topic, TopicTokenCount.count > 0)
+        .order_by(TopicTokenCount.count.desc())
+        .limit(k)
+        .all()
+    )
+    return {row.token: row.count for row in rows}
@@ -0,0 +1,142 @@
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.metrics import metrics
+from app.result_cache import analysis_key, normalize_topic, refresh
+from app.service import build_analysis, refresh_results
+
+# Background cache warmer for the most requested topics
+# The first request for a popular topic after its cache entry expired (or after a restart) used to pay the whole
+# cold path: Reddit fetch, scoring, database writes and chart rendering. The warmer counts the topics /analyze is
+# asked for and every WARMER_INTERVAL seconds refreshes the top WARMER_TOP_N of them before their entries expire:
+# new posts are fetched and saved (refresh_results) and the /analyze cache entry is rebuilt (app.result_cache).
+# Posts the topic already has rows for are not saved again, so the trend and the word counts do not grow with
+# every round.
+#
+# Stampede protection:
+#   - at most WARMER_CONCURRENCY topics are refreshed at a time (the Reddit rate limiter is shared as well)
+#   - every refresh starts after a random delay of up to WARMER_JITTER seconds
+#   - an entry that stays fresh until after the next round is skipped, so with several worker processes only the
+#     first one to get there refreshes it, and a topic being built by a request (build lock held) is skipped too
+#
+# Request counts live in the memory of each process and are halved after every round, so topics that stop being
+# asked for drop out. Corpus mode requests (source=corpus) are not counted, they never go to Reddit.
+#
+# Config (see create_app):
+#   WARMER_TOP_N        - topics refreshed per round (0 = warmer off)
+#   WARMER_INTERVAL     - seconds between two rounds, keep it below RESULT_CACHE_TTL
+#   WARMER_CONCURRENCY  - topics refreshed at the same time
+#   WARMER_JITTER       - max random delay in seconds before each refresh
+#   WARMER_MIN_REQUESTS - requests a topic needs (decayed count) before it is warmed
+
+logger = logging.getLogger(__name__)
+
+# Topics tracked at most, the least requested ones are forgotten beyond this
+MAX_TRACKED_TOPICS = 1000
+
+
+class CacheWarmer:
+    def __init__(self):
+        self.top_n = 0
+        self.interval = 900
+        self.concurrency = 2
+        self.jitter = 30.0
+        self.min_requests = 2
+        self.counts = {} # (normalized topic, limit) -> decayed request count
+        self.spellings = {} # (normalized topic, limit) -> the topic as first typed, rows are saved under it
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def init_app(self, app):
+        self.top_n = app.config.get('WARMER_TOP_N', self.top_n)
+        self.interval = app.config.get('WARMER_INTERVAL', self.interval)
+        self.concurrency = app.config.get('WARMER_CONCURRENCY', self.concurrency)
+        self.jitter = app.config.get('WARMER_JITTER', self.jitter)
+        self.min_requests = app.config.get('WARMER_MIN_REQUESTS', self.min_requests)
+        with self.lock:
+            self.counts.clear()
+            self.spellings.clear()
+        app.extensions['warmer'] = self
+        if self.top_n and not app.config.get('TESTING'):
+            self.start(app)
+
+    # Count one /analyze request
+    def record(self, topic, limit):
+        key = (normalize_topic(topic), int(limit))
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0.0) + 1
+            self.spellings.setdefault(key, topic)
+            if len(self.counts) > MAX_TRACKED_TOPICS:
+                least = min(self.counts, key=self.counts.get)
+                del self.counts[least]
+                self.spellings.pop(least, None)
+
+    # The most requested (topic, limit) pairs, most requested first, the topic as it was typed
+    def hot_topics(self, n=None):
+        with self.lock:
+            ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+            return [
+                (self.spellings[key], key[1]) for key, count in ranked[:n or self.top_n] if count >= self.min_requests
+            ]
+
+    # Halve every count and forget the topics that are hardly asked for any more
+    def _decay(self):
+        with self.lock:
+            self.counts = {key: count / 2 for key, count in self.counts.items() if count / 2 >= 0.1}
+            self.spellings = {key: topic for key, topic in self.spellings.items() if key in self.counts}
+
+    # Refresh one topic, returns 'refreshed', 'skipped' or 'failed'
+    def _warm_topic(self, app, topic, limit):
+        if self.stopped.wait(random.uniform(0, self.jitter)):
+            return 'skipped'
+
+        def compute():
+            refresh_results(topic, limit)
+            return build_analysis(topic, limit)
+
+        with app.app_context():
+            try:
+                # Still fresh at the next round (at most 10% later, see _loop) -> nothing to do yet
+                refreshed = refresh(analysis_key(topic, limit), compute, min_fresh=self.interval * 1.1 + self.jitter)
+            except Exception:
+                logger.exception('Warming %s failed', topic)
+                return 'failed'
+        return 'refreshed' if refreshed else 'skipped'
+
+    # One round: refresh the hot topics, at most `concurrency` at a time, returns {(topic, limit): outcome}
+    def warm_once(self, app):
+        hot = self.hot_topics()
+        outcomes = {}
+        if hot:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='cache-warmer') as pool:
+                futures = {key: pool.submit(self._warm_topic, app, *key) for key in hot}
+                for key, future in futures.items():
+                    outcomes[key] = future.result()
+                    metrics.warmer_refreshes.inc(result=outcomes[key])
+            logger.info('Cache warmer refreshed %s of %s hot topics',
+                        list(outcomes.values()).count('refreshed'), len(hot))
+        self._decay()
+        return outcomes
+
+    def _loop(self, app):
+        while not self.stopped.wait(self.interval * random.uniform(0.9, 1.1)):
+            self.warm_once(app)
+
+    def start(self, app):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._loop, args=(app,), name='cache-warmer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+warmer = CacheWarmer()
@@ -0,0 +1,88 @@
+# Throughput and memory of the streaming export (app.export) on a big table
+# Fills a throwaway database with --rows result rows, then exports them as CSV and as gzip NDJSON to /dev/null
+# and reports rows per second and the peak Python memory (tracemalloc) of each export.
+# The peak should stay about the same for 100k and for 5M rows - only one chunk of rows is held at a time.
+#
+# Usage (from the project root):
+#   python benchmarks/bench_export.py --rows 2000000
+#   python benchmarks/bench_export.py --rows 2000000 --database-uri postgresql://.../empty_bench_db
+#
+# A --database-uri must point at an EMPTY database created for the benchmark, it refuses to run against one with tables.
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import make_scored_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description='streaming export throughput and memory')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--topics', type=int, default=100)
+    parser.add_argument('--distinct-posts', type=int, default=20_000, help='posts the rows are spread over')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--database-uri', default=None)
+    parser.add_argument('--output', default=None, help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    database_uri = args.database_uri or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = database_uri
+    os.environ.setdefault('CACHE_TYPE', 'NullCache')
+
+    from sqlalchemy import inspect
+    from app import create_app, db
+    from app.export import FORMATS, export_results
+    from app.persistence import bulk_insert_results
+
+    app = create_app()
+    report = {"rows": args.rows, "database": database_uri.split(':', 1)[0], "formats": {}}
+    with app.app_context():
+        existing_tables = inspect(db.engine).get_table_names()
+        if existing_tables:
+            sys.exit(
+                f'Refusing to run: {database_uri.split("@")[-1]} already has tables ({", ".join(existing_tables)}). '
+                'Point --database-uri at an empty database created for the benchmark.'
+            )
+        db.create_all()
+
+        posts = make_scored_corpus(args.distinct_posts)
+        start = time.perf_counter()
+        per_topic = args.rows // args.topics
+        for index in range(args.topics):
+            offset = index * per_topic % len(posts)
+            batch = (posts * (per_topic // len(posts) + 2))[offset:offset + per_topic]
+            bulk_insert_results(f'topic-{index}', batch)
+        report["fill_seconds"] = time.perf_counter() - start
+
+        for output_format in FORMATS:
+            stats = {}
+            tracemalloc.start()
+            with open(os.devnull, 'wb') as sink:
+                for chunk in export_results(output_format, chunk_size=args.chunk_size, stats=stats):
+                    sink.write(chunk)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report["formats"][output_format] = {
+                "rows": stats["rows"],
+                "megabytes": stats["bytes"] / 1e6,
+                "seconds": stats["seconds"],
+                "rows_per_sec": stats["rows_per_sec"],
+                "peak_memory_mb": peak / 1e6,
+            }
+
+        db.drop_all()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# Benchmark suite for the /analyze hot paths: scoring, chart rendering, database insert/query and the full route
+# Every stage is timed at several corpus sizes on the synthetic corpus (benchmarks/corpus.py),
+# the Reddit fetch is replaced by app.fake_reddit.FakeReddit so no network is needed and runs are repeatable
+#
+# Usage (from the project root so nltk_data is found):
+#   python benchmarks/bench_hot_paths.py --sizes 10,100,1000 --output bench_results.json
+#   python benchmarks/bench_hot_paths.py --output new.json --compare bench_results.json
+#
+# --compare prints the change of every median against an earlier run and exits with status 1
+# when anything got slower than --threshold (default 20%)
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import make_corpus, make_scored_corpus
+
+
+# Run function `repeats` times (after one untimed warm up call), returns min/median/mean seconds
+# setup - optional function called before every run, its return value is passed to function and not timed
+def measure(function, repeats, setup=None):
+    def run_once():
+        arguments = (setup(),) if setup else ()
+        start = time.perf_counter()
+        function(*arguments)
+        return time.perf_counter() - start
+
+    run_once()
+    timings = [run_once() for _ in range(repeats)]
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "repeats": repeats,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_scoring(sizes, repeats):
+    from app.analysis import analyse_sentiment
+    from app.fast_analysis import analyse_sentiment_fast
+
+    report = {"analyse_sentiment": {}, "analyse_sentiment_fast": {}}
+    for size in sizes:
+        posts = make_corpus(size)
+        report["analyse_sentiment"][size] = measure(lambda: analyse_sentiment(posts), repeats)
+        report["analyse_sentiment_fast"][size] = measure(lambda: analyse_sentiment_fast(posts), repeats)
+    return report
+
+
+# generate_graphs() caches by content, render_graphs() is the uncached work behind it
+def bench_graphs(sizes, repeats):
+    from app.graphs import render_graphs
+    from app.token_counts import count_tokens
+
+    report = {"generate_graphs": {}, "generate_graphs_word_counts": {}}
+    for size in sizes:
+        results = make_scored_corpus(size)
+        word_counts = dict(count_tokens(result['content'] for result in results).most_common(200))
+        report["generate_graphs"][size] = measure(lambda: render_graphs(results, 'benchmark'), repeats)
+        report["generate_graphs_word_counts"][size] = measure(
+            lambda: render_graphs(results, 'benchmark', word_counts=word_counts), repeats
+        )
+    return report
+
+
+# Insert and read back on a throwaway SQLite database
+def bench_database(app, sizes, repeats):
+    from app.persistence import bulk_insert_results, latest_results, page_results
+
+    report = {"bulk_insert": {}, "latest_results": {}, "page_results": {}}
+    with app.app_context():
+        for size in sizes:
+            results = make_scored_corpus(size)
+            runs = iter(range(repeats + 1))
+            report["bulk_insert"][size] = measure(
+                lambda topic: bulk_insert_results(topic, results), repeats,
+                setup=lambda: f'insert-{size}-{next(runs)}'
+            )
+            topic = f'insert-{size}-0'
+            report["latest_results"][size] = measure(lambda: latest_results(topic, size), repeats)
+            report["page_results"][size] = measure(lambda: page_results(topic, min(size, 50)), repeats)
+    return report
+
+
+# The whole /analyze request through the Flask test client
+# cold - a topic that is not stored or cached yet (fetch, score, save, render)
+# warm - the same request again, answered from the result cache
+def bench_route(app, sizes, repeats):
+    from app.fake_reddit import FakeReddit
+    from app.fetch_reddit_data import fetch_reddit_data
+
+    reddit = FakeReddit()
+    report = {"analyze_route_cold": {}, "analyze_route_warm": {}}
+    fake_fetch = lambda topic, limit=10: fetch_reddit_data(topic, limit, reddit=reddit)
+    with patch('app.fetch_reddit_data.fetch_reddit_data', side_effect=fake_fetch), app.test_client() as client:
+        def request(topic, size):
+            response = client.post('/api/sentiment/analyze', data={'topic': topic, 'num_records': size})
+            assert response.status_code == 200, response.status_code
+
+        for size in sizes:
+            runs = iter(range(repeats + 1))
+            report["analyze_route_cold"][size] = measure(
+                lambda topic: request(topic, size), repeats,
+                setup=lambda: f'route {size} {next(runs)}'
+            )
+            report["analyze_route_warm"][size] = measure(lambda: request(f'route {size} 0', size), repeats)
+    return report
+
+
+# Print the change of every median against an earlier report, returns the names that got slower than threshold
+def compare(report, baseline, threshold):
+    regressions = []
+    for name, by_size in report["results"].items():
+        for size, timing in by_size.items():
+            before = baseline.get("results", {}).get(name, {}).get(str(size))
+            if not before:
+                continue
+            change = timing["median"] / before["median"] - 1 if before["median"] else 0.0
+            flag = ''
+            if change > threshold:
+                flag = '  <-- slower'
+                regressions.append(f'{name}[{size}]')
+            print(f'{name:32} {size:>8} {before["median"] * 1000:10.2f} ms -> {timing["median"] * 1000:10.2f} ms  {change:+.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='/analyze hot path benchmarks')
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated corpus sizes (posts)')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', default='scoring,graphs,database,route', help='comma separated groups to run')
+    parser.add_argument('--output', default=None, help='write the results as JSON to this file')
+    parser.add_argument('--compare', default=None, help='earlier JSON report to compare the medians against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown that counts as a regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    groups = set(args.only.split(','))
+
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['CACHE_TYPE'] = 'SimpleCache'
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+
+    results = {}
+    if 'scoring' in groups:
+        results.update(bench_scoring(sizes, args.repeats))
+    if 'graphs' in groups:
+        results.update(bench_graphs(sizes, args.repeats))
+    if 'database' in groups:
+        results.update(bench_database(app, sizes, args.repeats))
+    if 'route' in groups:
+        results.update(bench_route(app, sizes, args.repeats))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "repeats": args.repeats,
+            "created_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        # sizes are strings so a report read back from JSON looks the same as a fresh one
+        "results": {name: {str(size): timing for size, timing in by_size.items()} for name, by_size in results.items()},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.threshold)
+        if regressions:
+            print(f'Regressions: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# Benchmark for the sentiment_analysis write and read paths
+# Compares the old per-row db.session.add() inserts against app.persistence.bulk_insert_results()
+# and times the "newest rows for a topic" lookup with and without the topic indexes ((topic, created_at) and (topic, id))
+#
+# Usage (from the project root so nltk_data is found):
+#   python benchmarks/bench_persistence.py --rows 1000000
+#   python benchmarks/bench_persistence.py --rows 1000000 --database-uri postgresql://.../empty_bench_db
+#
+# The benchmark creates, fills and drops its own tables. Without --database-uri it uses a throwaway SQLite file.
+# A --database-uri must point at an EMPTY database created for the benchmark, it refuses to run against one with tables.
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_results(count, rng):
+    for index in range(count):
+        score = round(rng.uniform(-1, 1), 4)
+        yield {
+            "title": f"post {index}",
+            "content": f"synthetic content for post {index} " * 4,
+            "sentiment": 'POSITIVE' if score >= 0 else 'NEGATIVE',
+            "score": score,
+        }
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    return time.perf_counter() - start, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sentiment_analysis insert/lookup benchmark')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--topics', type=int, default=1000)
+    parser.add_argument('--orm-rows', type=int, default=20_000,
+                        help='rows inserted one ORM object at a time, extrapolated to --rows (the old path is too slow to run in full)')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--database-uri', default=None)
+    parser.add_argument('--output', default=None, help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    database_uri = args.database_uri or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = database_uri
+    os.environ.setdefault('CACHE_TYPE', 'NullCache')
+
+    from sqlalchemy import inspect, text
+    from app import create_app, db
+    from app.models import SentimentAnalysis
+    from app.persistence import bulk_insert_results, latest_results
+
+    app = create_app()
+    rng = random.Random(42)
+    topics = [f'topic-{i}' for i in range(args.topics)]
+    report = {"rows": args.rows, "topics": args.topics, "database": database_uri.split(':', 1)[0]}
+
+    with app.app_context():
+        existing_tables = inspect(db.engine).get_table_names()
+        if existing_tables:
+            sys.exit(
+                f'Refusing to run: {database_uri.split("@")[-1]} already has tables ({", ".join(existing_tables)}). '
+                'Point --database-uri at an empty database created for the benchmark.'
+            )
+        db.create_all()
+
+        # Old path - one ORM object per row, extrapolated
+        def orm_insert():
+            for index, row in enumerate(make_results(args.orm_rows, rng)):
+                db.session.add(SentimentAnalysis(topic=topics[index % len(topics)], **row))
+            db.session.commit()
+        seconds, _ = timed(orm_insert)
+        report["orm_insert_rows_per_sec"] = args.orm_rows / seconds
+        report["orm_insert_seconds_extrapolated"] = seconds * args.rows / args.orm_rows
+        db.session.execute(text('DELETE FROM sentiment_analysis'))
+        db.session.commit()
+
+        # New path - bulk insert, one batch of rows per topic like the pipeline does
+        def bulk_insert():
+            for topic in topics:
+                bulk_insert_results(topic, make_results(args.rows // len(topics), rng), args.chunk_size)
+        seconds, _ = timed(bulk_insert)
+        report["bulk_insert_seconds"] = seconds
+        report["bulk_insert_rows_per_sec"] = args.rows / seconds
+
+        # Lookups with the composite index
+        def lookups():
+            for _ in range(args.lookups):
+                latest_results(rng.choice(topics), 10)
+        seconds, _ = timed(lookups)
+        report["indexed_lookup_ms"] = seconds * 1000 / args.lookups
+
+        # Same lookups after dropping the indexes (what the table looked like before)
+        # both go: (topic, id) would otherwise still serve the topic filter
+        db.session.execute(text('DROP INDEX ix_sentiment_analysis_topic_created_at'))
+        db.session.execute(text('DROP INDEX ix_sentiment_analysis_topic_id'))
+        db.session.commit()
+        seconds, _ = timed(lookups)
+        report["unindexed_lookup_ms"] = seconds * 1000 / args.lookups
+
+        db.drop_all()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# Startup time report - which modules make `create_app()` slow to import and build
+# Runs a fresh interpreter with `python -X importtime` and sorts the modules by cumulative import time
+#
+# Usage (from the project root):
+#   python benchmarks/bench_startup.py --top 25 --output startup.json
+#   python benchmarks/bench_startup.py --prewarm        (the same with PREWARM=1, what a prewarmed worker pays)
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_CODE = 'from app import create_app; create_app()'
+
+
+# Run code in a new interpreter with -X importtime, returns (wall seconds, {module: (self_us, cumulative_us)})
+def import_times(code=STARTUP_CODE, env=None):
+    env = dict(os.environ, **(env or {}))
+    env.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'startup.db'))
+    env.setdefault('CACHE_TYPE', 'SimpleCache')
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    seconds = time.perf_counter() - start
+
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return seconds, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='create_app() import time breakdown')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--prewarm', action='store_true', help='run with PREWARM=1')
+    parser.add_argument('--output', default=None, help='write the report as JSON to this file')
+    args = parser.parse_args()
+
+    seconds, modules = import_times(env={'PREWARM': '1' if args.prewarm else '0'})
+    top = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+    report = {
+        "wall_seconds": seconds,
+        "modules_imported": len(modules),
+        "top_cumulative_ms": {name: cumulative / 1000 for name, (_, cumulative) in top},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
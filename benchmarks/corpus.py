@@ -0,0 +1,39 @@
+# Synthetic post corpus for the benchmarks
+# Same text generator as app.fake_reddit (sentiment words mixed with neutral filler), seeded so every run
+# scores and renders exactly the same posts and timings from different runs can be compared
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.fake_reddit import make_post_text
+
+
+# `count` posts shaped like fetch_reddit_data() output
+# min_words / max_words - length of every post body in words
+def make_corpus(count, topic='benchmark', seed=42, min_words=20, max_words=120):
+    rng = random.Random(f'{seed}:{topic}:{count}')
+    return [
+        {
+            "title": f'{topic} post {index}',
+            "content": make_post_text(rng, topic, min_words, max_words),
+            "url": f'https://reddit.example/{topic}/{index}',
+        }
+        for index in range(count)
+    ]
+
+
+# Scored results (what the pipeline saves) for the persistence benchmarks, without paying for the scoring
+def make_scored_corpus(count, topic='benchmark', seed=42):
+    rng = random.Random(f'{seed}:{topic}:scores')
+    results = []
+    for post in make_corpus(count, topic, seed):
+        score = round(rng.uniform(-1, 1), 4)
+        results.append({
+            "title": post['title'],
+            "content": post['content'],
+            "sentiment": 'POSITIVE' if score >= 0 else 'NEGATIVE',
+            "score": score,
+        })
+    return results
@@ -1,14 +1,54 @@
+import base64
+import csv
+import gzip
+import io
+import json
+import logging
+import logging.handlers
+import os
+import subprocess
+import sys
+import threading
+import time
 import pytest
+from collections import Counter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask
-from app import create_app, db
-from app.models import SentimentAnalysis
-from app.analysis import analyse_sentiment
+from app import create_app, db, cache
+from app.models import Post, SentimentAnalysis, ScoreCache, TopicTokenCount, SentimentRollup
+from app.analysis import analyse_sentiment, analyse_sentiment_batch, get_pool, DEFAULT_MIN_POOL_BATCH
+from app.fast_analysis import analyse_sentiment_fast, parity_report
 from app.fetch_reddit_data import fetch_reddit_data
+from app.fake_reddit import FakeReddit, FakeRedditServer
+from app.reddit_client import TokenBucket, fetch_many, reset_client
+from app.pipeline import stream_pipeline, run_pipeline
+from app.persistence import bulk_insert_results, latest_results
+from app.migrations import upgrade_database, migrate_to_posts
+from app.score_cache import score_posts, score_memo, purge_stale_scores
+from app.graphs import generate_graphs, results_digest
+from app.token_counts import record_tokens, remove_tokens, top_tokens, rebuild_token_counts
+from app.rollups import rebuild_rollups, trend
+from app.retention import compact
+from app.warmer import warmer
+from app.search import search
+from app.metrics import metrics
+from app.logger import configure_logger, shutdown_logging, RateLimitFilter
+from app.result_cache import cached_analysis, analysis_key, get_or_compute, shutdown_refresher
 from unittest.mock import patch
 
 # pip install pytest-mock --> pytest-mock is a testing tool that lets you replace real code with fake code during testing.
 # You have to mock the functionality which you have written in routes
 
+# The tests log to a temporary folder instead of logs/ in the project
+@pytest.fixture(autouse=True)
+def log_dir(tmp_path_factory, monkeypatch):
+    directory = tmp_path_factory.mktemp('logs')
+    monkeypatch.setenv('LOG_DIR', str(directory))
+    shutdown_logging() # the next configure_logger() call (create_app) opens the log in the new folder
+    yield directory
+    shutdown_logging()
+
 @pytest.fixture
 def client():
     app = create_app()
@@ -71,3 +111,781 @@ def test_invalid_input(client):
     assert response.status_code == 400
     assert 'Topic is required' in response.data.decode('utf-8')
 
+def test_analyze_sentiment_batch_matches_single_process():
+    posts = [
+        {"title": f"post {i}", "content": text}
+        for i, text in enumerate([
+            "I love this, it is great!",
+            "This is terrible and I hate it.",
+            "Nothing special here.",
+            "Not bad at all, pretty good actually",
+        ] * 5)
+    ]
+    expected = analyse_sentiment(posts)
+    # min_batch=0 forces the process pool even for this small batch
+    results = analyse_sentiment_batch(iter(posts), workers=2, chunksize=3, min_batch=0)
+    assert results == expected
+
+# Parity suite for the fast engine - it should agree with the reference VADER engine on (almost) everything
+PARITY_TEXTS = [
+    "I love this, it is great!",
+    "This is terrible and I hate it.",
+    "Nothing special here.",
+    "Not bad at all, pretty good actually",
+    "The movie was VERY good but the ending was awful",
+    "I don't like it",
+    "At least it works",
+    "This is the least useful thing ever",
+    "kind of sad",
+    "Absolutely amazing!!!",
+    "Why is this so bad??",
+    "It was never so good",
+    "I am not happy :(",
+    "Good :)",
+    "",
+    "I enjoy Finance and tech. I was aiming to make the most money out of college and was stuck between data science or Finance. Any help?",
+    "Any suggestion will be much appreciated. I am US citizen.",
+    "The service was slow, the food was cold and the staff were rude.",
+    "Honestly the best experience I have had in years, highly recommend!",
+    "It's okay I guess, nothing to write home about.",
+]
+
+def test_fast_engine_parity():
+    posts = [{"title": str(i), "content": text} for i, text in enumerate(PARITY_TEXTS)]
+    report = parity_report(posts)
+    assert report['count'] == len(posts)
+    assert report['label_agreement'] >= 0.95
+    assert report['mean_abs_diff'] <= 0.02
+
+    # Same output format as the reference engine
+    fast = analyse_sentiment_fast(posts)
+    assert [r['title'] for r in fast] == [p['title'] for p in posts]
+    assert set(fast[0]) == {'title', 'content', 'sentiment', 'score'}
+    assert isinstance(fast[0]['score'], float)
+
+def test_fast_engine_single_short_post():
+    # Batches with fewer than three tokens in total (common once the score cache filters out known posts)
+    for text in ["great post", "no", "Good :)", "I love it", "It was never so good"]:
+        posts = [{"title": "short", "content": text}]
+        assert analyse_sentiment_fast(posts) == analyse_sentiment(posts)
+
+def test_fast_engine_selected_by_batch():
+    posts = [{"title": "a", "content": "I love this, it is great!"}]
+    assert analyse_sentiment_batch(posts, engine='fast') == analyse_sentiment_fast(posts)
+
+def test_fetch_reddit_data_is_lazy_generator():
+    reddit = FakeReddit()
+    posts = fetch_reddit_data('python', limit=5, reddit=reddit)
+    # Nothing is fetched until the generator is iterated
+    assert reddit.subreddit('all').served == 0
+    first = next(posts)
+    assert reddit.read_only is True
+    assert first['title'] == 'python post 0'
+    assert len(list(posts)) == 4
+
+def test_streaming_pipeline_scores_and_saves_in_micro_batches(client):
+    reddit = FakeReddit()
+    with client.application.app_context():
+        batches = stream_pipeline('python', fetch_reddit_data('python', limit=25, reddit=reddit), batch_size=10)
+        first_batch = next(batches)
+        # The first batch is ready (and saved) after reading only 10 posts from the source
+        assert len(first_batch) == 10
+        assert reddit.subreddit('all').served == 10
+        assert SentimentAnalysis.query.filter_by(topic='python').count() == 10
+
+        rest = [result for batch in batches for result in batch]
+        assert len(rest) == 15
+        assert SentimentAnalysis.query.filter_by(topic='python').count() == 25
+
+def test_run_pipeline_matches_analyse_sentiment(client):
+    posts = list(fetch_reddit_data('flask', limit=12, reddit=FakeReddit()))
+    with client.application.app_context():
+        assert run_pipeline('flask', posts, batch_size=5) == analyse_sentiment(posts)
+
+def test_bulk_insert_and_indexed_lookup(client):
+    results = analyse_sentiment([
+        {"title": f"post {i}", "content": "I love this" if i % 2 else "I hate this"} for i in range(7)
+    ])
+    with client.application.app_context():
+        assert bulk_insert_results('bulk', results, chunk_size=3) == 7
+        rows = latest_results('bulk', 5)
+        assert len(rows) == 5
+        assert {row.topic for row in rows} == {'bulk'}
+
+        # Running the migrations again on an existing database is safe and the index is there
+        upgrade_database()
+        upgrade_database()
+        index_names = {index['name'] for index in db.inspect(db.engine).get_indexes('sentiment_analysis')}
+        assert 'ix_sentiment_analysis_topic_created_at' in index_names
+
+def test_score_cache_hits_and_invalidation(client):
+    posts = [
+        {"title": "one", "content": "I love this, it is great!"},
+        {"title": "two", "content": "This is terrible and I hate it."},
+        {"title": "one again", "content": "I love this, it is great!"},
+    ]
+    with client.application.app_context():
+        score_memo.clear()
+        first = score_posts(posts)
+        assert first == analyse_sentiment(posts)
+        assert score_memo.stats()['misses'] == 2 # the repeated content is scored once
+        assert ScoreCache.query.count() == 2
+
+        # Second time everything comes from the in-process LRU
+        assert score_posts(posts) == first
+        assert score_memo.stats()['memory_hits'] == 2
+
+        # After a restart (empty LRU) the scores come from the table
+        score_memo.clear()
+        assert score_posts(posts) == first
+        assert score_memo.stats()['db_hits'] == 2
+        assert score_memo.stats()['misses'] == 0
+
+        # Scores of the other engine stay valid
+        score_posts(posts[:1], engine='fast')
+        assert ScoreCache.query.count() == 3
+
+        # Rows from an older engine version are never used and can be purged, current rows of both engines stay
+        db.session.add(ScoreCache(content_hash='x' * 64, engine_version='vader-old', sentiment='POSITIVE', score=0.1))
+        db.session.commit()
+        assert purge_stale_scores() == 1
+        assert ScoreCache.query.count() == 3
+
+def test_generate_graphs_in_memory_and_cached():
+    results = analyse_sentiment([
+        {"title": "a", "content": "I love this great project"},
+        {"title": "b", "content": "This release is terrible and broken"},
+    ])
+    bar_chart_64, word_cloud_b64 = generate_graphs(results, 'graphs-topic')
+    assert base64.b64decode(bar_chart_64).startswith(b'\x89PNG')
+    assert base64.b64decode(word_cloud_b64).startswith(b'\x89PNG')
+
+    # Identical results and topic are served from the rendered-image cache
+    with patch('app.graphs.render_graphs') as mock_render:
+        assert generate_graphs(results, 'graphs-topic') == (bar_chart_64, word_cloud_b64)
+        mock_render.assert_not_called()
+
+    # Several threads rendering different result sets at the same time each get their own image
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        images = list(executor.map(lambda i: generate_graphs(results, f'thread-topic-{i}'), range(4)))
+    assert len({bar for bar, _ in images}) == 4
+
+def test_topic_token_counts_incremental(client):
+    with client.application.app_context():
+        record_tokens('tokens', ["Great code, great team!", "The code is broken"])
+        record_tokens('tokens', ["great release"])
+        counts = top_tokens('tokens')
+        assert counts['great'] == 3
+        assert counts['code'] == 2
+        assert list(top_tokens('tokens', k=1)) == ['great']
+
+        # Purging a post subtracts its words, words that reach zero disappear
+        remove_tokens('tokens', ["The code is broken"])
+        counts = top_tokens('tokens')
+        assert counts['code'] == 1
+        assert 'broken' not in counts
+        assert TopicTokenCount.query.filter_by(topic='tokens', token='broken').first() is None
+
+        # Many words at once (one executemany, not one UPDATE per word)
+        words = [f'word{chr(97 + i // 26)}{chr(97 + i % 26)}' for i in range(300)]
+        record_tokens('many', [' '.join(words)] * 2)
+        remove_tokens('many', [' '.join(words[:200])])
+        assert top_tokens('many', k=1000) == {**{word: 1 for word in words[:200]}, **{word: 2 for word in words[200:]}}
+
+def test_rebuild_token_counts_for_rows_saved_before_counting(client):
+    app = client.application
+    with app.app_context():
+        # rows saved without counting their words (as before topic_token_count existed)
+        bulk_insert_results('old', [
+            {"title": "a", "content": "old words here", "sentiment": 'POSITIVE', "score": 0.1},
+            {"title": "b", "content": "more old words", "sentiment": 'POSITIVE', "score": 0.1},
+        ])
+        record_tokens('old', ['stale'])
+        assert rebuild_token_counts() == 1
+        assert top_tokens('old') == {'old': 2, 'words': 2, 'here': 1, 'more': 1}
+
+    with app.app_context():
+        db.session.execute(db.delete(TopicTokenCount))
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=['rebuild-token-counts', '--topic', 'old'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert top_tokens('old')['old'] == 2
+
+def test_pipeline_records_token_counts(client):
+    posts = list(fetch_reddit_data('tokens', limit=6, reddit=FakeReddit()))
+    with client.application.app_context():
+        run_pipeline('pipeline-tokens', posts, batch_size=4)
+        expected = Counter(' '.join(post['content'] for post in posts).lower().replace('.', '').replace('!', '').replace('?', '').split())
+        assert top_tokens('pipeline-tokens', k=1000) == dict(expected)
+
+def test_async_analyze_job(client):
+    release = threading.Event()
+
+    def slow_fetch(topic, limit=10, reddit=None):
+        release.wait(5)
+        yield from fetch_reddit_data(topic, limit, reddit=FakeReddit())
+
+    with patch('app.fetch_reddit_data.fetch_reddit_data', side_effect=slow_fetch):
+        response = client.post('/api/sentiment/analyze/jobs', data={'topic': 'async', 'num_records': 5})
+        assert response.status_code == 202
+        job = response.get_json()
+        assert job['created'] is True
+        assert job['status'] in ('queued', 'running')
+
+        # Same topic + limit while the first job is still in flight attaches to it
+        duplicate = client.post('/api/sentiment/analyze/jobs', json={'topic': 'Async ', 'num_records': 5}).get_json()
+        assert duplicate['job_id'] == job['job_id']
+        assert duplicate['created'] is False
+
+        release.set()
+        deadline = time.time() + 30
+        while True:
+            status = client.get(job['status_url']).get_json()
+            if status['status'] in ('done', 'failed') or time.time() > deadline:
+                break
+            time.sleep(0.05)
+
+    assert status['status'] == 'done'
+    assert status['progress'] == 1.0
+    assert len(status['result']['sentiment_results']) == 5
+    assert status['result']['bar_chart_64']
+    assert client.get('/api/sentiment/analyze/jobs/unknown').status_code == 404
+
+    # The job filled the /analyze result cache, a second job (or the HTML route) is answered from it
+    with patch('app.fetch_reddit_data.fetch_reddit_data') as mock_fetch:
+        second = client.post('/api/sentiment/analyze/jobs', data={'topic': 'ASYNC', 'num_records': 5}).get_json()
+        assert second['created'] is True
+        deadline = time.time() + 30
+        while client.get(second['status_url']).get_json()['status'] != 'done' and time.time() < deadline:
+            time.sleep(0.05)
+        status = client.get(second['status_url']).get_json()
+        assert status['progress'] == 1.0
+        assert len(status['result']['sentiment_results']) == 5
+        assert client.get('/api/sentiment/analyze?topic=async&num_records=5').status_code == 200
+        mock_fetch.assert_not_called()
+
+def test_async_analyze_job_rejects_bad_num_records(client):
+    response = client.post('/api/sentiment/analyze/jobs', data={'topic': 'async', 'num_records': 'lots'})
+    assert response.status_code == 400
+    assert 'num_records' in response.get_json()['error']
+
+def test_pipeline_batch_reaches_process_pool(client, monkeypatch):
+    # A full pipeline micro-batch is big enough for analyse_sentiment_batch() to use the pool
+    monkeypatch.setenv('SENTIMENT_ENGINE', 'vader')
+    monkeypatch.setenv('SENTIMENT_WORKERS', '2')
+    monkeypatch.delenv('SENTIMENT_POOL_MIN_BATCH', raising=False)
+    batch_size = client.application.config['PIPELINE_BATCH_SIZE']
+    posts = list(fetch_reddit_data('process pool batch', limit=batch_size, reddit=FakeReddit(seed=11)))
+    assert len(posts) >= DEFAULT_MIN_POOL_BATCH
+
+    with client.application.app_context(), patch('app.analysis.get_pool', wraps=get_pool) as pool:
+        batches = list(stream_pipeline('pool', posts))
+    pool.assert_called()
+    assert len(batches) == 1
+    assert [result['score'] for result in batches[0]] == [result['score'] for result in analyse_sentiment(posts)]
+
+def test_graph_cache_key_ignores_text_with_word_counts():
+    results = [{"title": "a", "content": "some long post text", "sentiment": "POSITIVE", "score": 0.5}]
+    counts = {"post": 2, "text": 1}
+    edited = [dict(results[0], content="other text entirely")]
+    # With pre-aggregated counts the key does not depend on (or hash) the post text
+    assert results_digest(results, 't', counts) == results_digest(edited, 't', counts)
+    assert results_digest(results, 't', counts) != results_digest(results, 't', {"post": 3})
+    # Without counts the word cloud comes from the text, so the text is part of the key
+    assert results_digest(results, 't') != results_digest(edited, 't')
+
+def test_results_api_cursor_pagination_and_ndjson(client):
+    results = analyse_sentiment([{"title": f"post {i}", "content": f"good post number {i}"} for i in range(23)])
+    with client.application.app_context():
+        bulk_insert_results('api', results)
+
+    # Walk every page with the cursor (rows share created_at, the cursor must still advance)
+    seen = []
+    cursor = None
+    for _ in range(10):
+        url = '/api/sentiment/results?topic=api&limit=10' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        seen.extend(row['id'] for row in page['results'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert cursor is None
+    assert len(seen) == 23
+    assert len(set(seen)) == 23
+    assert 'bar_chart_64' not in page
+
+    response = client.get('/api/sentiment/results?topic=api&format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert [row['id'] for row in rows] == seen
+
+    # NDJSON can resume from a cursor too
+    first_page = client.get('/api/sentiment/results?topic=api&limit=10').get_json()
+    response = client.get(f"/api/sentiment/results?topic=api&format=ndjson&cursor={first_page['next_cursor']}")
+    assert [json.loads(line)['id'] for line in response.data.decode('utf-8').splitlines()] == seen[10:]
+
+    assert client.get('/api/sentiment/results?topic=api&cursor=garbage').status_code == 400
+    assert client.get('/api/sentiment/results').status_code == 400
+
+def test_results_api_fetches_unknown_topic(client):
+    with patch('app.fetch_reddit_data.fetch_reddit_data', side_effect=lambda topic, limit=10: fetch_reddit_data(topic, limit, reddit=FakeReddit())):
+        # A plain GET only reads
+        assert client.get('/api/sentiment/results?topic=fresh&limit=4').get_json()['results'] == []
+        page = client.get('/api/sentiment/results?topic=fresh&limit=4&fetch=1').get_json()
+    assert len(page['results']) == 4
+    assert page['next_cursor'] is None
+
+
+def test_rollups_follow_inserts_and_rebuild(client):
+    with client.application.app_context():
+        bulk_insert_results('trend', [
+            {"title": "a", "content": "great", "sentiment": 'POSITIVE', "score": 0.6},
+            {"title": "b", "content": "awful", "sentiment": 'NEGATIVE', "score": -0.4},
+        ])
+        bulk_insert_results('trend', [{"title": "c", "content": "fine", "sentiment": 'POSITIVE', "score": 0.2}])
+        bulk_insert_results('other', [{"title": "d", "content": "ok", "sentiment": 'POSITIVE', "score": 0.1}])
+
+        daily = trend('trend', 'day')
+        assert sum(bucket['count'] for bucket in daily) == 3
+        assert sum(bucket['positive'] for bucket in daily) == 2
+        assert min(bucket['min_score'] for bucket in daily) == -0.4
+        assert max(bucket['max_score'] for bucket in daily) == 0.6
+        assert sum(bucket['count'] for bucket in trend('trend', 'hour')) == 3
+
+        incremental = {(r.topic, r.granularity, r.bucket_start): (r.count, r.positive, r.negative, round(r.score_sum, 6))
+                       for r in SentimentRollup.query.all()}
+        rebuild_rollups()
+        rebuilt = {(r.topic, r.granularity, r.bucket_start): (r.count, r.positive, r.negative, round(r.score_sum, 6))
+                   for r in SentimentRollup.query.all()}
+        assert rebuilt == incremental
+
+    response = client.get('/api/sentiment/trend?topic=trend&bucket=hour')
+    assert response.status_code == 200
+    assert sum(bucket['count'] for bucket in response.get_json()['trend']) == 3
+    assert client.get('/api/sentiment/trend?topic=trend&since=2999-01-01').get_json()['trend'] == []
+    assert client.get('/api/sentiment/trend?topic=trend&bucket=week').status_code == 400
+    assert client.get('/api/sentiment/trend?topic=trend&since=yesterday').status_code == 400
+
+def _fake_analysis(topic, limit, corpus=False):
+    return {"topic": topic, "source": 'reddit', "sentiment_results": [], "bar_chart_64": '', "word_cloud_b64": '', "limit": limit}
+
+def test_analyze_cache_keys_are_normalized(client):
+    with patch('app.result_cache.build_analysis', side_effect=_fake_analysis) as mock_build:
+        assert client.get('/api/sentiment/analyze?topic=Science&num_records=1').status_code == 200
+        assert client.get('/api/sentiment/analyze?topic=%20science%20%20&num_records=1').status_code == 200
+        assert client.post('/api/sentiment/analyze', data={'topic': 'SCIENCE', 'num_records': 1}).status_code == 200
+        # a different limit from the query string is a different entry
+        assert client.get('/api/sentiment/analyze?topic=science&num_records=2').status_code == 200
+        # only the key is normalized, the first spelling is what the analysis is built (and saved) for
+        assert [c.args for c in mock_build.call_args_list] == [('Science', 1), ('science', 2)]
+
+    assert client.get('/api/sentiment/analyze?topic=science&num_records=many').status_code == 400
+    assert client.get('/api/sentiment/analyze?topic=%20%20').status_code == 400
+
+def test_analyze_keeps_the_topic_as_typed(client):
+    reddit = FakeReddit(seed=5)
+    fake_fetch = lambda topic, limit=10: fetch_reddit_data(topic, limit, reddit=reddit)
+    with patch('app.fetch_reddit_data.fetch_reddit_data', side_effect=fake_fetch):
+        assert client.post('/api/sentiment/analyze', data={'topic': 'Python', 'num_records': 5}).status_code == 200
+    with client.application.app_context():
+        assert db.session.query(SentimentAnalysis.topic).distinct().all() == [('Python',)]
+    assert len(client.get('/api/sentiment/results?topic=Python').get_json()['results']) == 5
+
+def test_analyze_cache_coalesces_concurrent_misses(client):
+    app = client.application
+    calls = []
+
+    def slow_build(topic, limit, corpus=False):
+        calls.append(topic)
+        time.sleep(0.3)
+        return _fake_analysis(topic, limit)
+
+    def request_analysis(_):
+        with app.app_context():
+            return cached_analysis('busy topic', 5)['topic']
+
+    with patch('app.result_cache.build_analysis', side_effect=slow_build):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            topics = list(pool.map(request_analysis, range(8)))
+    assert topics == ['busy topic'] * 8
+    assert len(calls) == 1
+
+def test_analyze_cache_serves_stale_while_refreshing(client):
+    app = client.application
+    app.config['RESULT_CACHE_TTL'] = 0
+    versions = iter(['first', 'second'])
+    refreshed = threading.Event()
+
+    def compute():
+        value = next(versions)
+        if value == 'second':
+            refreshed.set()
+        return value
+
+    with app.app_context():
+        key = analysis_key('stale', 1)
+        assert get_or_compute(key, compute) == 'first'
+        # the entry is already stale: the old value comes back at once and one refresh runs in the background
+        assert get_or_compute(key, compute) == 'first'
+        assert refreshed.wait(5)
+        shutdown_refresher()
+        assert cache.get(key)['value'] == 'second'
+
+@pytest.fixture
+def reddit_server(monkeypatch):
+    with FakeRedditServer(fail_topics={'forbidden'}) as server:
+        monkeypatch.setenv('REDDIT_OAUTH_URL', server.url)
+        monkeypatch.setenv('REDDIT_URL', server.url)
+        monkeypatch.setenv('REDDIT_CLIENT_ID', 'test-id')
+        monkeypatch.setenv('REDDIT_CLIENT_SECRET', 'test-secret')
+        monkeypatch.setenv('REDDIT_USER_AGENT', 'sentinal-tests/1.0')
+        monkeypatch.setenv('REDDIT_REQUESTS_PER_MINUTE', '6000')
+        reset_client()
+        yield server
+    reset_client()
+
+def test_fetch_many_against_fake_reddit_server(reddit_server):
+    results, errors = fetch_many(['python', 'flask', 'forbidden', 'python'], limit=4, max_workers=3)
+    assert sorted(results) == ['flask', 'python']
+    assert [post['title'] for post in results['python']] == [f'python post {i}' for i in range(4)]
+    assert list(errors) == ['forbidden']
+
+    # fetch_reddit_data() goes through the same shared client and still swallows errors
+    assert len(list(fetch_reddit_data('flask', limit=2))) == 2
+    assert list(fetch_reddit_data('forbidden', limit=2)) == []
+    searches = [path for method, path in reddit_server.requests if method == 'GET']
+    assert len(searches) == 5
+
+def test_token_bucket_honours_rate_limit_headers():
+    bucket = TokenBucket(rate=1000, capacity=5)
+    bucket.update_from_headers({'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '0.3'})
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.25
+
+    # steady rate once the burst is used up
+    bucket = TokenBucket(rate=20, capacity=1)
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.14
+
+def test_metrics_endpoint_reports_stages_and_cache(client):
+    misses = metrics.cache_requests.value(result='miss')
+    hits = metrics.cache_requests.value(result='hit')
+    scored = metrics.stage_seconds.count(stage='score')
+    with patch('app.fetch_reddit_data.fetch_reddit_data', side_effect=lambda topic, limit=10: fetch_reddit_data(topic, limit, reddit=FakeReddit())):
+        assert client.get('/api/sentiment/analyze?topic=metrics&num_records=3').status_code == 200
+        assert client.get('/api/sentiment/analyze?topic=metrics&num_records=3').status_code == 200
+    assert metrics.cache_requests.value(result='miss') == misses + 1
+    assert metrics.cache_requests.value(result='hit') == hits + 1
+    assert metrics.stage_seconds.count(stage='score') == scored + 1
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    for name in ('fetch', 'score', 'db_write', 'render_graphs', 'template'):
+        assert f'sentinal_stage_seconds_count{{stage="{name}"}}' in text
+    assert 'sentinal_result_cache_requests_total{result="hit"}' in text
+    assert 'sentinal_request_seconds_bucket{endpoint="sentiment.analyze_sentiment_route",method="GET",le="+Inf"}' in text
+
+def test_slow_requests_are_profiled(client, tmp_path):
+    metrics.profile_threshold = 0.0001
+    metrics.profile_sample_rate = 1.0
+    metrics.profile_dir = str(tmp_path)
+    try:
+        assert client.get('/api/sentiment/results?topic=nothing').status_code == 200
+    finally:
+        metrics.profile_threshold = 0.0
+        metrics.profile_sample_rate = 0.1
+    assert [path.suffix for path in tmp_path.iterdir()] == ['.prof']
+
+def test_startup_does_not_import_heavy_modules(tmp_path):
+    # Fresh interpreter with -X importtime, the same breakdown benchmarks/bench_startup.py reports
+    code = 'from app import create_app; import app.analysis; create_app(); print(app.analysis._analyzer is None)'
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path}/startup.db', CACHE_TYPE='SimpleCache', PREWARM='0')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True, check=True
+    )
+    imported = {
+        line.split('|')[-1].strip()
+        for line in completed.stderr.splitlines() if line.startswith('import time:')
+    }
+    assert 'app.routes' in imported
+    for heavy in ('matplotlib', 'seaborn', 'wordcloud', 'nltk', 'pandas'):
+        assert heavy not in imported, f'{heavy} is imported at startup'
+    # The analyzer is not built until something is scored
+    assert completed.stdout.strip() == 'True'
+
+def test_prewarm_loads_lazy_parts(client):
+    from app.prewarm import prewarm
+    from app import analysis
+
+    timings = prewarm(client.application)
+    assert {'analyzer', 'plotting', 'database'} <= set(timings)
+    assert analysis._analyzer is not None
+    assert analysis.sia is analysis.get_analyzer()
+
+def test_configure_logger_is_idempotent():
+    logger = configure_logger()
+    assert configure_logger() is logger
+    handlers = [handler for handler in logging.getLogger('app').handlers if isinstance(handler, logging.handlers.QueueHandler)]
+    assert len(handlers) == 1
+    assert logger.handlers == []
+
+def test_request_logs_are_json_with_request_id(client, tmp_path):
+    shutdown_logging()
+    configure_logger(log_dir=str(tmp_path))
+    try:
+        with patch('app.result_cache.build_analysis', side_effect=_fake_analysis):
+            response = client.get('/api/sentiment/analyze?topic=logging', headers={'X-Request-ID': 'req-42'})
+        assert response.headers['X-Request-ID'] == 'req-42'
+    finally:
+        shutdown_logging() # flushes the queue
+
+    records = [json.loads(line) for line in (tmp_path / 'app.log').read_text().splitlines()]
+    summary = [record for record in records if record.get('request_id') == 'req-42']
+    assert summary and summary[-1]['status'] == 200
+    assert summary[-1]['path'] == '/api/sentiment/analyze'
+    assert 'template' in summary[-1]['stage_durations']
+
+def test_request_summary_lines_are_not_rate_limited(client, tmp_path, monkeypatch):
+    monkeypatch.setenv('LOG_RATE_LIMIT', '2')
+    monkeypatch.setenv('LOG_SAMPLE_EVERY', '100')
+    shutdown_logging()
+    configure_logger(log_dir=str(tmp_path))
+    try:
+        for index in range(30):
+            client.get('/api/sentiment/search', headers={'X-Request-ID': f'load-{index}'})
+    finally:
+        shutdown_logging() # flushes the queue
+
+    records = [json.loads(line) for line in (tmp_path / 'app.log').read_text().splitlines()]
+    assert sorted(record['request_id'] for record in records if 'status' in record) == sorted(f'load-{index}' for index in range(30))
+    assert all('_rate_limit' not in record for record in records)
+
+def test_rate_limit_filter_samples_repeated_messages():
+    log_filter = RateLimitFilter(limit=3, window=60, sample_every=10)
+    def record(level=logging.INFO):
+        return logging.LogRecord('app.test', level, __file__, 1, 'same message %s', (1,), None)
+
+    passed = [log_filter.filter(record()) for _ in range(33)]
+    assert sum(passed) == 3 + 3
+    assert log_filter.filter(record(logging.ERROR))
+
+def test_full_text_search_across_topics(client):
+    with client.application.app_context():
+        bulk_insert_results('ai', [
+            {"title": "Intro to machine learning", "content": "machine learning is great fun", "sentiment": 'POSITIVE', "score": 0.8},
+            {"title": "Cooking", "content": "I love baking bread", "sentiment": 'POSITIVE', "score": 0.6},
+        ])
+        bulk_insert_results('jobs', [
+            {"title": "ML jobs", "content": "machine learning hiring is awful", "sentiment": 'NEGATIVE', "score": -0.5},
+            {"title": "Intro to machine learning", "content": "machine learning is great fun", "sentiment": 'POSITIVE', "score": 0.8},
+        ])
+        results = search('Machine   Learning', limit=10)
+        # the post saved under two topics comes back once
+        assert sorted(result['title'] for result in results) == ['Intro to machine learning', 'ML jobs']
+        assert results[0]['rank'] >= results[1]['rank']
+        assert search('"unbalanced OR', limit=5) == []
+        assert [result['topic'] for result in search('machine learning', topic='jobs')] == ['jobs', 'jobs']
+
+        # deleted rows leave the index too
+        SentimentAnalysis.query.filter_by(topic='jobs').delete()
+        db.session.commit()
+        assert [result['topic'] for result in search('hiring')] == []
+
+        # a database without a full text index falls back to LIKE: every word, in any order, % taken literally
+        with patch.object(db.engine.dialect, 'name', 'other'):
+            assert [result['title'] for result in search('LEARNING machine', limit=10)] == ['Intro to machine learning']
+            assert search('100%', limit=10) == []
+            assert [result['topic'] for result in search('machine', topic='ai')] == ['ai']
+
+    response = client.get('/api/sentiment/search?q=bread')
+    assert response.status_code == 200
+    assert [result['title'] for result in response.get_json()['results']] == ['Cooking']
+    assert client.get('/api/sentiment/search').status_code == 400
+
+    with patch('app.fetch_reddit_data.fetch_reddit_data') as mock_fetch:
+        response = client.get('/api/sentiment/analyze?topic=machine+learning&source=corpus')
+        assert response.status_code == 200
+        assert b'Intro to machine learning' in response.data
+        assert client.get('/api/sentiment/analyze?topic=quantum&source=corpus').status_code == 404
+        mock_fetch.assert_not_called()
+
+def test_search_index_added_to_existing_database(client):
+    with client.application.app_context():
+        db.session.execute(db.text('DROP TABLE post_fts'))
+        db.session.execute(db.text('DROP TRIGGER post_fts_insert'))
+        db.session.commit()
+        db.session.add(SentimentAnalysis(topic='old', title='Old post', content='stored before search existed', sentiment='POSITIVE', score=0.1))
+        db.session.commit()
+        upgrade_database()
+        assert [result['title'] for result in search('existed')] == ['Old post']
+
+def test_posts_stored_once(client):
+    shared = {"title": "Same post", "content": "fetched for two topics", "sentiment": 'POSITIVE', "score": 0.4}
+    other = {"title": "Other post", "content": "only once", "sentiment": 'NEGATIVE', "score": -0.2}
+    with client.application.app_context():
+        bulk_insert_results('a', [shared, other])
+        bulk_insert_results('b', [shared])
+        bulk_insert_results('a', [shared])
+        db.session.add(SentimentAnalysis(topic='c', title='Same post', content='fetched for two topics', sentiment='POSITIVE', score=0.4))
+        db.session.commit()
+        assert Post.query.count() == 2
+        assert SentimentAnalysis.query.count() == 5
+        assert {row.title for row in latest_results('a', 10)} == {'Same post', 'Other post'}
+        # the placeholder content of link posts does not merge different posts
+        bulk_insert_results('a', [
+            {"title": "Link one", "content": "No content Available", "sentiment": 'NEUTRAL', "score": 0.0},
+            {"title": "Link two", "content": "No content Available", "sentiment": 'NEUTRAL', "score": 0.0},
+        ])
+        assert Post.query.count() == 4
+
+def test_migrate_legacy_table(client):
+    with client.application.app_context():
+        db.drop_all()
+        # sentiment_analysis as it was before the post table, with its search table and indexes
+        for statement in [
+            'CREATE TABLE sentiment_analysis (id INTEGER PRIMARY KEY, topic VARCHAR(255) NOT NULL, title TEXT NOT NULL, '
+            'content TEXT NOT NULL, sentiment VARCHAR(10) NOT NULL, score FLOAT NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)',
+            'CREATE INDEX ix_sentiment_analysis_topic_created_at ON sentiment_analysis (topic, created_at)',
+            'CREATE INDEX ix_sentiment_analysis_topic_id ON sentiment_analysis (topic, id)',
+            "CREATE VIRTUAL TABLE sentiment_analysis_fts USING fts5(title, content, content='sentiment_analysis', content_rowid='id')",
+        ]:
+            db.session.execute(db.text(statement))
+        for index, (topic, title) in enumerate([('a', 'first'), ('b', 'first'), ('a', 'second'), ('a', 'third'), ('b', 'second')]):
+            db.session.execute(db.text(
+                'INSERT INTO sentiment_analysis (id, topic, title, content, sentiment, score) '
+                "VALUES (:id, :topic, :title, 'text of ' || :title, 'POSITIVE', 0.5)"
+            ), {"id": index * 10 + 1, "topic": topic, "title": title})
+        db.session.commit()
+        db.create_all()
+
+        # startup only checks the schema, the copy is a separate command
+        with pytest.raises(RuntimeError, match='migrate-posts'):
+            upgrade_database()
+        result = client.application.test_cli_runner().invoke(args=['migrate-posts', '--batch-size', '2'])
+        assert result.exit_code == 0, result.output
+        assert 'Copied 5 rows' in result.output
+        assert migrate_to_posts() == 0 # nothing left to migrate
+        upgrade_database()
+        assert Post.query.count() == 3
+        assert [row.id for row in SentimentAnalysis.query.order_by(SentimentAnalysis.id)] == [1, 11, 21, 31, 41]
+        assert db.session.get(SentimentAnalysis, 41).title == 'second'
+        assert not db.inspect(db.engine).has_table('sentiment_analysis_legacy')
+        assert [result['title'] for result in search('third')] == ['third']
+        bulk_insert_results('a', [{"title": "first", "content": "text of first", "sentiment": 'POSITIVE', "score": 0.5}])
+        assert Post.query.count() == 3
+        assert latest_results('a', 1)[0].id == 42
+
+def test_compaction_removes_old_rows_and_orphan_posts(client):
+    app = client.application
+    with app.app_context():
+        old = [{"title": f"old {i}", "content": f"ancient words {i}", "sentiment": 'NEGATIVE', "score": -0.1} for i in range(5)]
+        kept = {"title": "shared", "content": "ancient words kept", "sentiment": 'POSITIVE', "score": 0.3}
+        bulk_insert_results('history', old + [kept])
+        record_tokens('history', [post['content'] for post in old + [kept]])
+        db.session.execute(db.update(SentimentAnalysis).values(created_at=db.func.datetime('now', '-40 days')))
+        db.session.commit()
+        bulk_insert_results('history', [kept])
+        record_tokens('history', [kept['content']])
+        rollup_count = SentimentRollup.query.count()
+
+        assert compact(30, batch_size=2) == {"rows": 6, "posts": 5}
+        assert [row.title for row in SentimentAnalysis.query.all()] == ['shared']
+        assert [post.title for post in Post.query.all()] == ['shared']
+        assert top_tokens('history') == {'ancient': 1, 'words': 1, 'kept': 1}
+        assert SentimentRollup.query.count() == rollup_count # trends keep their history
+        assert compact(30) == {"rows": 0, "posts": 0}
+
+    result = app.test_cli_runner().invoke(args=['compact', '--days', '30'])
+    assert result.exit_code == 0
+    assert 'Removed 0 rows and 0 posts' in result.output
+    assert app.test_cli_runner().invoke(args=['compact']).exit_code != 0
+
+def test_streaming_export(client, tmp_path):
+    app = client.application
+    with app.app_context():
+        bulk_insert_results('export', [
+            {"title": f"post {i}", "content": f"text, with \"quotes\" {i}\nand a new line", "sentiment": 'POSITIVE', "score": i / 10}
+            for i in range(5)
+        ])
+        db.session.execute(db.update(SentimentAnalysis).where(SentimentAnalysis.id <= 2).values(created_at=datetime(2026, 1, 1)))
+        db.session.commit()
+        bulk_insert_results('other', [{"title": "other", "content": "not exported", "sentiment": 'NEGATIVE', "score": -0.3}])
+
+    with patch('app.export.ROWS_PER_CHUNK', 2):
+        response = client.get('/api/sentiment/export?topic=export')
+        assert response.status_code == 200
+        assert response.headers['Content-Disposition'] == 'attachment; filename="export.csv"'
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        assert [row['title'] for row in rows] == [f'post {i}' for i in range(5)]
+        assert rows[3]['content'] == 'text, with "quotes" 3\nand a new line'
+
+        response = client.get('/api/sentiment/export?topic=export&format=ndjson&since=2026-02-01')
+        assert response.mimetype == 'application/gzip'
+        lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+        assert [json.loads(line)['title'] for line in lines] == ['post 2', 'post 3', 'post 4']
+        assert json.loads(lines[0])['score'] == 0.2
+
+    response = client.get('/api/sentiment/export?topic=export&until=2026-01-02T00:00:00')
+    assert len(list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))) == 2
+    assert client.get('/api/sentiment/export?topic=export&format=xml').status_code == 400
+    assert client.get('/api/sentiment/export?topic=export&since=yesterday').status_code == 400
+    assert client.get('/api/sentiment/export').status_code == 400
+
+    output = tmp_path / 'all.ndjson.gz'
+    result = app.test_cli_runner().invoke(args=['export', '--format', 'ndjson', '--output', str(output), '--chunk-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Exported 6 rows' in result.output
+    topics = [json.loads(line)['topic'] for line in gzip.decompress(output.read_bytes()).decode('utf-8').splitlines()]
+    assert topics == ['export'] * 5 + ['other']
+
+def test_cache_warmer_refreshes_hot_topics(client):
+    app = client.application
+    app.config.update(WARMER_TOP_N=1, WARMER_JITTER=0, WARMER_MIN_REQUESTS=2, WARMER_INTERVAL=900)
+    warmer.init_app(app)
+    cache.clear()
+    reddit = FakeReddit(seed=3)
+    fake_fetch = lambda topic, limit=10: fetch_reddit_data(topic, limit, reddit=reddit)
+
+    with patch('app.fetch_reddit_data.fetch_reddit_data', side_effect=fake_fetch) as mock_fetch:
+        for topic in ['Python', ' python ', 'rust']:
+            assert client.get(f'/api/sentiment/analyze?topic={topic}&num_records=4').status_code == 200
+        client.get('/api/sentiment/analyze?topic=rust&num_records=4&source=corpus')
+        assert warmer.hot_topics() == [('Python', 4)]
+
+        # Entry still fresh until after the next round - nothing to refresh yet
+        assert warmer.warm_once(app) == {('Python', 4): 'skipped'}
+
+        with app.app_context():
+            cache.delete(analysis_key('python', 4))
+            stored = SentimentAnalysis.query.filter_by(topic='Python').count()
+            rollups = [(row.count, row.score_sum) for row in SentimentRollup.query.filter_by(topic='Python')]
+            tokens = top_tokens('Python')
+        mock_fetch.reset_mock()
+        warmer.record('python', 4)
+        assert warmer.warm_once(app) == {('Python', 4): 'refreshed'}
+        # the topic is fetched again under the spelling its rows have, and the cache entry is back
+        mock_fetch.assert_called_once_with('Python', 4)
+        with app.app_context():
+            assert cache.get(analysis_key('python', 4)) is not None
+            # the same posts came back - nothing is saved or counted twice
+            assert SentimentAnalysis.query.filter_by(topic='Python').count() == stored
+            assert [(row.count, row.score_sum) for row in SentimentRollup.query.filter_by(topic='Python')] == rollups
+            assert top_tokens('Python') == tokens
+            assert SentimentAnalysis.query.filter_by(topic='python').count() == 0
+
+        hits = metrics.cache_requests.value(result='hit')
+        assert client.get('/api/sentiment/analyze?topic=PYTHON&num_records=4').status_code == 200
+        assert metrics.cache_requests.value(result='hit') == hits + 1
+        assert metrics.warmer_refreshes.value(result='refreshed') >= 1
+
+    # Counts are halved after every round, a topic nobody asks for any more stops being warmed
+    for _ in range(3):
+        warmer.warm_once(app)
+    assert warmer.hot_topics() == []